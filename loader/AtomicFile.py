@@ -0,0 +1,46 @@
+'''
+This module is responsible for replacing the index, manifest and listing files shared by the
+loaders and the writers. Every file is written under a unique temporary name next to it and then
+moved over the old file, so that readers, including those that memory map it, only ever see a
+complete old or a complete new file and concurrent writers never write into the same file.
+'''
+
+# dependencies
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def replace_file(file_path, mode='w'):
+    '''Method for opening a temporary file that replaces file_path once it is closed without error.
+    The temporary file is removed when the block raises.
+
+    Input: file_path, mode
+        file_path (string): The location of the file to replace.
+        mode (string): The mode of the temporary file, 'w' or 'wb'. Default is 'w'.
+
+    Output: file
+        file (file object): The open temporary file.
+    '''
+    directory = os.path.dirname(os.path.abspath(file_path))
+    handle, temp_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + '.',
+                                         suffix='.tmp', dir=directory)
+    file = os.fdopen(handle, mode)
+    try:
+        # mkstemp only lets the owner read, the replaced file keeps the permissions of the old one
+        try:
+            permissions = os.stat(file_path).st_mode & 0o777
+        except OSError:
+            permissions = 0o644
+        os.chmod(temp_path, permissions)
+        with file:
+            yield file
+        os.replace(temp_path, file_path)
+    except BaseException:
+        file.close()
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,855 @@
+'''
+This module stores the audio storage backends read by the data loaders. Every backend exposes the
+clips written by the DataWriter through the same interface: the clip names, their lengths and
+methods for reading a single clip or a whole batch of clips as channel first arrays. The clips are
+read in their storage dtype and every store holds the scale that dequantize applies to turn them
+into float32 audio.
+'''
+
+# dependencies
+import json
+import multiprocessing
+import os
+import weakref
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+import h5py
+try:
+    # registers the blosc and lz4 filters that the DataWriter may compress the audio with
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+# the largest gap in frames between two clips of a batch that is read over instead of seeking
+MAX_READ_GAP = 1 << 16
+# the sample rate of files written before the writer stored it
+DEFAULT_SAMPLE_RATE = 44100
+# the group of the source manifest the DataWriter stores in its .h5 files
+MANIFEST_GROUP = 'manifest'
+# the number of shards of a sharded store that are kept open at the same time
+MAX_OPEN_SHARDS = 16
+
+
+class H5Handle:
+    '''Process local handle to a .h5 file. The file is only opened on first use and is reopened
+    whenever the handle is used from a different process, so DataLoader workers never share
+    HDF5 state with the process that forked them.
+
+    Args: file_path
+        file_path (string): The location of the .h5 file.
+    '''
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = None
+        self._pid = None
+
+    def get(self):
+        '''Method for retrieving the open h5py.File for the current process
+
+        Output: frame
+            frame (h5py.File): The open .h5 file.
+        '''
+        if self._pid != os.getpid():
+            # a handle inherited across a fork belongs to the parent so it is dropped, not closed
+            self._file = h5py.File(self.file_path, 'r')
+            self._pid = os.getpid()
+        return self._file
+
+    def close(self):
+        '''Method for closing the handle if it was opened by the current process'''
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file = None
+        self._pid = None
+
+    def __getstate__(self):
+        # open handles can not be sent to spawned workers, they reopen the file instead
+        return {'file_path': self.file_path, '_file': None, '_pid': None}
+
+
+def rate_path(file_path, sample_rate):
+    '''Method for naming the file holding the audio of file_path resampled to another rate
+
+    Input: file_path, sample_rate
+        file_path (string): The location of the audio file, for example 'Phil.h5'.
+        sample_rate (int): The sample rate of the resampled audio.
+
+    Output: file_path
+        file_path (string): The location of the resampled audio file, for example 'Phil_16000.h5'.
+    '''
+    root, extension = os.path.splitext(file_path)
+    return '{}_{}{}'.format(root, sample_rate, extension)
+
+
+def dequantize(clip, scale):
+    '''Method for converting a clip read in its storage dtype to float32 audio in one pass
+
+    Input: clip, scale
+        clip (np.ndarray): The clip as read from a store.
+        scale (float): The scale of the storage dtype of the store.
+
+    Output: clip
+        clip (np.ndarray): The float32 audio, the clip itself when it already is float32 audio.
+    '''
+    if scale == 1 and clip.dtype == np.float32:
+        return clip
+    return np.multiply(clip, np.float32(scale), dtype=np.float32)
+
+
+def decode_names(names):
+    '''Method for converting names read from a .h5 file to python strings
+
+    Input: names
+        names (iterable): The names as stored in the file.
+
+    Output: names
+        names (list): The names as strings.
+    '''
+    return [name.decode() if isinstance(name, bytes) else str(name) for name in names]
+
+
+def disk_order(dsets):
+    '''Method for ordering h5py datasets by their location in the file so that a batch of reads
+    walks through the file front to back. Datasets without a fixed location (chunked or compact
+    storage) keep their original order after the contiguous ones.
+
+    Input: dsets
+        dsets (list): The h5py datasets to be read.
+
+    Output: order
+        order (list): Positions of dsets sorted by their byte offset in the file.
+    '''
+    offsets = [dset.id.get_offset() for dset in dsets]
+    return sorted(range(len(dsets)),
+                  key=lambda pos: (offsets[pos] is None, offsets[pos] or 0, pos))
+
+
+class KeyedStore:
+    '''Audio store for .h5 files holding one dataset per clip, each of shape (channels, frames).
+
+    Args: file_path
+        file_path (string): The location of the .h5 file.
+    '''
+    def __init__(self, file_path):
+        self.handle = H5Handle(file_path)
+        self.names = [name for name in self.handle.get().keys() if name != MANIFEST_GROUP]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.channels = self.handle.get()[self.names[0]].shape[0] if self.names else 1
+        self.dtype = self.handle.get()[self.names[0]].dtype if self.names else np.dtype('float32')
+        self.scale = float(self.handle.get().attrs.get('scale', 1.0))
+        self.sample_rate = int(self.handle.get().attrs.get('sample_rate', DEFAULT_SAMPLE_RATE))
+        self._lengths = None
+        self.handle.close()
+
+    @property
+    def lengths(self):
+        '''The number of frames of every clip, looked up from the dataset shapes on first use'''
+        if self._lengths is None:
+            frame = self.handle.get()
+            self._lengths = np.array([frame[name].shape[-1] for name in self.names],
+                                     dtype=np.int64)
+        return self._lengths
+
+    def read(self, row, start=0, stop=None):
+        '''Method for reading frames start to stop of a single clip
+
+        Input: row, start, stop
+            row (int): The row of the clip in names.
+            start (int): The first frame to read.
+            stop (int): The frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (np.ndarray): The frames of shape (channels, stop - start).
+        '''
+        return self.handle.get()[self.names[row]][..., start:stop]
+
+    def read_into(self, rows, out, starts=None):
+        '''Method for reading a batch of clips into a preallocated buffer. Clip pos is read from
+        frame starts[pos] into out[pos] until either the clip or the buffer runs out of frames.
+
+        Input: rows, out, starts
+            rows (list): The rows of the clips in names.
+            out (np.ndarray): The buffer of shape (batch, channels, frames) to read into.
+            starts (list): The first frame to read from each clip. Default is 0 for every clip.
+
+        Output: num_frames
+            num_frames (np.ndarray): The number of frames read into every row of out.
+        '''
+        frame = self.handle.get()
+        dsets = [frame[self.names[row]] for row in rows]
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else starts
+        num_frames = np.zeros(len(rows), dtype=np.int64)
+        for pos in disk_order(dsets):
+            start = int(starts[pos])
+            num_frames[pos] = max(min(dsets[pos].shape[-1] - start, out.shape[-1]), 0)
+            if not num_frames[pos]:
+                continue
+            dsets[pos].read_direct(out[pos], np.s_[..., start:start + num_frames[pos]],
+                                   np.s_[..., :num_frames[pos]])
+        return num_frames
+
+    def close(self):
+        '''Method for closing the .h5 file opened by the current process'''
+        self.handle.close()
+
+
+def missing_sources(dataset, file_path):
+    '''Method for finding the source files of a virtual dataset that do not exist, whose frames
+    HDF5 would silently read as zeros
+
+    Input: dataset, file_path
+        dataset (h5py.Dataset): The dataset to check.
+        file_path (string): The location of the file holding dataset.
+
+    Output: missing
+        missing (list): The missing source files, empty for a dataset that is not virtual.
+    '''
+    if not dataset.is_virtual:
+        return []
+    # HDF5 looks for relative sources next to the file first and then in the working directory
+    directory = os.path.dirname(os.path.abspath(file_path))
+    missing = []
+    for source in dataset.virtual_sources():
+        if source.file_name == '.' or source.file_name in missing:
+            continue
+        if not any(os.path.exists(path) for path in (os.path.join(directory, source.file_name),
+                                                     source.file_name)):
+            missing.append(source.file_name)
+    return missing
+
+
+class PackedStore:
+    '''Audio store for packed .h5 files. Every clip is concatenated into one 'audio' dataset of
+    shape (frames, channels), the 'index' dataset holds the (offset, length) of every clip and the
+    'names' dataset holds the clip names in the same order, so any clip or slice of a clip can be
+    read with a single hyperslab read. Packed datasets with more dimensions per frame, such as the
+    (frames, channels, bins) features written by the FeatureWriter, are read the same way, and so
+    are the master files of the VirtualWriter whose 'audio' dataset maps the audio of every shard.
+    A master file is only opened when all of its shards exist.
+
+    Args: file_path, dataset
+        file_path (string): The location of the .h5 file.
+        dataset (string): The name of the packed dataset. Default is 'audio'.
+    '''
+    def __init__(self, file_path, dataset='audio'):
+        self.handle = H5Handle(file_path)
+        self.dataset = dataset
+        frame = self.handle.get()
+        missing = missing_sources(frame[dataset], file_path)
+        if missing:
+            self.handle.close()
+            raise FileNotFoundError('{} maps the missing files {}'.format(
+                file_path, ', '.join(missing)))
+        self.names = decode_names(frame['names'][:])
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        index = frame['index'][:]
+        self.offsets = index[:, 0]
+        self.lengths = index[:, 1]
+        self.frame_shape = frame[dataset].shape[1:]
+        self.channels = self.frame_shape[0]
+        self.dtype = frame[dataset].dtype
+        self.scale = float(frame[dataset].attrs.get('scale', 1.0))
+        self.sample_rate = int(frame.attrs.get('sample_rate', DEFAULT_SAMPLE_RATE))
+        self.handle.close()
+
+    def read(self, row, start=0, stop=None):
+        '''Method for reading frames start to stop of a single clip
+
+        Input: row, start, stop
+            row (int): The row of the clip in names.
+            start (int): The first frame to read.
+            stop (int): The frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (np.ndarray): The frames of shape (channels, stop - start).
+        '''
+        stop = self.lengths[row] if stop is None else min(stop, self.lengths[row])
+        offset = self.offsets[row]
+        return np.moveaxis(self.handle.get()[self.dataset][offset + start:offset + stop], 0, -1)
+
+    def read_into(self, rows, out, starts=None):
+        '''Method for reading a batch of clips into a preallocated buffer. Clip pos is read from
+        frame starts[pos] into out[pos] until either the clip or the buffer runs out of frames.
+        Clips that lie close together in the file are read with one hyperslab read.
+
+        Input: rows, out, starts
+            rows (list): The rows of the clips in names.
+            out (np.ndarray): The buffer of shape (batch, channels, frames) to read into.
+            starts (list): The first frame to read from each clip. Default is 0 for every clip.
+
+        Output: num_frames
+            num_frames (np.ndarray): The number of frames read into every row of out.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else np.asarray(starts)
+        num_frames = np.clip(np.minimum(self.lengths[rows] - starts, out.shape[-1]), 0, None)
+        begins = self.offsets[rows] + starts
+        ends = begins + num_frames
+        # group the clips that lie close together in the file, in on-disk order
+        groups = []
+        for pos in np.argsort(begins, kind='stable'):
+            if groups and begins[pos] - groups[-1][1] <= MAX_READ_GAP:
+                groups[-1][1] = max(groups[-1][1], ends[pos])
+                groups[-1][2].append(pos)
+            else:
+                groups.append([begins[pos], ends[pos], [pos]])
+        packed = self.handle.get()[self.dataset]
+        for span_start, span_stop, members in groups:
+            # one read covering every clip in the group
+            span = packed[span_start:span_stop]
+            for pos in members:
+                local = begins[pos] - span_start
+                out[pos, ..., :num_frames[pos]] = np.moveaxis(
+                    span[local:local + num_frames[pos]], 0, -1)
+        return num_frames
+
+    def close(self):
+        '''Method for closing the .h5 file opened by the current process'''
+        self.handle.close()
+
+
+class MemmapStore:
+    '''Audio store for raw files written by the DataWriter. The frames of every clip are stored
+    back to back as a flat (frames, channels) array and the JSON index stored next to it at
+    file_path + '.json' holds the dtype, the channel count and the name, offset and length of every
+    clip. The file is memory mapped so that clips are zero-copy views backed by the OS page cache,
+    which is shared by every process on the node that reads the same file.
+
+    Args: file_path
+        file_path (string): The location of the raw audio file.
+    '''
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path + '.json') as index_file:
+            index = json.load(index_file)
+        self.dtype = np.dtype(index['dtype'])
+        self.scale = index.get('scale', 1.0)
+        self.channels = index['channels']
+        self.sample_rate = index.get('sample_rate') or DEFAULT_SAMPLE_RATE
+        self.names = index['names']
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.offsets = np.array(index['offsets'], dtype=np.int64)
+        self.lengths = np.array(index['lengths'], dtype=np.int64)
+        self._audio = None
+
+    @property
+    def audio(self):
+        '''The memory mapped (frames, channels) array, mapped on first use'''
+        if self._audio is None:
+            if os.path.getsize(self.file_path):
+                # copy on write so that the views are writable without ever touching the file
+                self._audio = np.memmap(self.file_path, dtype=self.dtype,
+                                        mode='c').reshape(-1, self.channels)
+            else:
+                self._audio = np.zeros((0, self.channels), dtype=self.dtype)
+        return self._audio
+
+    def read(self, row, start=0, stop=None):
+        '''Method for reading frames start to stop of a single clip without copying
+
+        Input: row, start, stop
+            row (int): The row of the clip in names.
+            start (int): The first frame to read.
+            stop (int): The frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (np.ndarray): A view of the frames of shape (channels, stop - start).
+        '''
+        stop = self.lengths[row] if stop is None else min(stop, self.lengths[row])
+        offset = self.offsets[row]
+        return self.audio[offset + start:offset + stop].T
+
+    def read_into(self, rows, out, starts=None):
+        '''Method for reading a batch of clips into a preallocated buffer. Clip pos is read from
+        frame starts[pos] into out[pos] until either the clip or the buffer runs out of frames.
+
+        Input: rows, out, starts
+            rows (list): The rows of the clips in names.
+            out (np.ndarray): The buffer of shape (batch, channels, frames) to read into.
+            starts (list): The first frame to read from each clip. Default is 0 for every clip.
+
+        Output: num_frames
+            num_frames (np.ndarray): The number of frames read into every row of out.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else np.asarray(starts)
+        num_frames = np.clip(np.minimum(self.lengths[rows] - starts, out.shape[-1]), 0, None)
+        begins = self.offsets[rows] + starts
+        # touch the pages in file order so that the kernel can read ahead
+        for pos in np.argsort(begins, kind='stable'):
+            out[pos, :, :num_frames[pos]] = self.audio[begins[pos]:begins[pos] + num_frames[pos]].T
+        return num_frames
+
+    def close(self):
+        '''Method for unmapping the raw file'''
+        self._audio = None
+
+    def __getstate__(self):
+        # the mapping is recreated in spawned workers instead of pickling the whole array
+        state = dict(self.__dict__)
+        state['_audio'] = None
+        return state
+
+
+class ShardedStore:
+    '''Audio store for outputs the DataWriter split into shards. The JSON shard manifest at
+    file_path lists the shard files next to it together with the names and lengths of their
+    clips, so the store is built without opening a single shard. Shards are opened on first read
+    and at most max_open of them are kept open, the least recently read shard is closed first.
+
+    Args: file_path, max_open
+        file_path (string): The location of the shard manifest.
+        max_open (int): The number of shards kept open. Default is MAX_OPEN_SHARDS.
+    '''
+    def __init__(self, file_path, max_open=MAX_OPEN_SHARDS):
+        self.file_path = file_path
+        self.max_open = max_open
+        with open(file_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        directory = os.path.dirname(file_path)
+        self.files = [os.path.join(directory, shard['file']) for shard in manifest['shards']]
+        self.channels = manifest['channels']
+        self.sample_rate = manifest.get('sample_rate') or DEFAULT_SAMPLE_RATE
+        self.dtype = np.dtype(manifest['dtype'])
+        self.scale = manifest.get('scale', 1.0)
+        self.names = [name for shard in manifest['shards'] for name in shard['names']]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.lengths = np.array([length for shard in manifest['shards']
+                                 for length in shard['lengths']], dtype=np.int64)
+        self.shard_of = np.repeat(np.arange(len(self.files), dtype=np.int64),
+                                  [len(shard['names']) for shard in manifest['shards']])
+        # the open shard stores, most recently read last
+        self.shards = OrderedDict()
+
+    def get_shard(self, shard):
+        '''Method for retrieving the store of a shard, opening it and closing the least recently
+        read shard when too many are open
+
+        Input: shard
+            shard (int): The position of the shard in files.
+
+        Output: store
+            store (KeyedStore, PackedStore or MemmapStore): The store of the shard.
+        '''
+        store = self.shards.get(shard)
+        if store is not None:
+            self.shards.move_to_end(shard)
+            return store
+        store = open_store(self.files[shard])
+        self.shards[shard] = store
+        while len(self.shards) > self.max_open:
+            _, evicted = self.shards.popitem(last=False)
+            evicted.close()
+        return store
+
+    def read(self, row, start=0, stop=None):
+        '''Method for reading frames start to stop of a single clip
+
+        Input: row, start, stop
+            row (int): The row of the clip in names.
+            start (int): The first frame to read.
+            stop (int): The frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (np.ndarray): The frames of shape (channels, stop - start).
+        '''
+        store = self.get_shard(self.shard_of[row])
+        return store.read(store.rows[self.names[row]], start, stop)
+
+    def read_into(self, rows, out, starts=None):
+        '''Method for reading a batch of clips into a preallocated buffer. Clip pos is read from
+        frame starts[pos] into out[pos] until either the clip or the buffer runs out of frames.
+        The clips of every shard are read with one batched read of that shard.
+
+        Input: rows, out, starts
+            rows (list): The rows of the clips in names.
+            out (np.ndarray): The buffer of shape (batch, channels, frames) to read into.
+            starts (list): The first frame to read from each clip. Default is 0 for every clip.
+
+        Output: num_frames
+            num_frames (np.ndarray): The number of frames read into every row of out.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else np.asarray(starts)
+        num_frames = np.zeros(len(rows), dtype=np.int64)
+        shards = self.shard_of[rows]
+        for shard in np.unique(shards):
+            members = np.flatnonzero(shards == shard)
+            store = self.get_shard(shard)
+            local = [store.rows[self.names[row]] for row in rows[members]]
+            if len(members) == len(rows):
+                return store.read_into(local, out, starts)
+            buffer = np.zeros((len(members),) + out.shape[1:], dtype=out.dtype)
+            num_frames[members] = store.read_into(local, buffer, starts[members])
+            out[members] = buffer
+        return num_frames
+
+    def close(self):
+        '''Method for closing every open shard'''
+        while self.shards:
+            _, store = self.shards.popitem(last=False)
+            store.close()
+
+    def __getstate__(self):
+        # spawned workers open their own shards
+        state = dict(self.__dict__)
+        state['shards'] = OrderedDict()
+        return state
+
+
+class CachedStore:
+    '''Byte budgeted LRU cache of whole decoded clips in front of another audio store. Clips are
+    cached by name the first time they are read, the least recently used clips are evicted once
+    the cached clips take up more than max_bytes and clips larger than max_bytes are never
+    cached. Clips are cached in their storage dtype so that compact dtypes fit more clips into the
+    budget. Every process keeps its own cache, so the budget holds per DataLoader worker and the
+    caches take up to max_bytes times the number of workers. The hits, misses and cached bytes of
+    all of them are also summed in shared counters that the training process can report.
+
+    Args: store, max_bytes
+        store (KeyedStore, PackedStore or MemmapStore): The store to cache clips from.
+        max_bytes (int): The byte budget of the cache.
+    '''
+    def __init__(self, store, max_bytes):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.clips = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # the hits, misses and cached bytes summed over this process and every worker
+        # created in a spawn context so that the lock can be passed to spawned and forked workers
+        self.totals = multiprocessing.get_context('spawn').Array('q', 3)
+
+    @property
+    def names(self):
+        '''The clip names of the cached store'''
+        return self.store.names
+
+    @property
+    def rows(self):
+        '''The rows of the clip names of the cached store'''
+        return self.store.rows
+
+    @property
+    def lengths(self):
+        '''The clip lengths of the cached store'''
+        return self.store.lengths
+
+    @property
+    def channels(self):
+        '''The channel count of the cached store'''
+        return self.store.channels
+
+    @property
+    def sample_rate(self):
+        '''The sample rate of the cached store'''
+        return self.store.sample_rate
+
+    @property
+    def dtype(self):
+        '''The storage dtype of the cached store'''
+        return self.store.dtype
+
+    @property
+    def scale(self):
+        '''The scale of the storage dtype of the cached store'''
+        return self.store.scale
+
+    def cacheable(self, row):
+        '''Method for checking whether a clip fits into the byte budget
+
+        Input: row
+            row (int): The row of the clip in names.
+
+        Output: cacheable
+            cacheable (bool): Whether the clip can be cached.
+        '''
+        return (self.store.lengths[row] * self.store.channels * self.store.dtype.itemsize
+                <= self.max_bytes)
+
+    def get_clip(self, row):
+        '''Method for retrieving a whole clip from the cache, reading and caching it on a miss
+
+        Input: row
+            row (int): The row of the clip in names.
+
+        Output: clip
+            clip (np.ndarray): The cached clip of shape (channels, frames).
+        '''
+        name = self.store.names[row]
+        clip = self.clips.get(name)
+        if clip is not None:
+            self.clips.move_to_end(name)
+            self.hits += 1
+            self.count(hits=1)
+            return clip
+        self.misses += 1
+        clip = np.array(self.store.read(row))
+        self.clips[name] = clip
+        nbytes = self.nbytes
+        self.nbytes += clip.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.clips.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        self.count(misses=1, nbytes=self.nbytes - nbytes)
+        return clip
+
+    def count(self, hits=0, misses=0, nbytes=0):
+        '''Method for adding to the counters shared by every process
+
+        Input: hits, misses, nbytes
+            hits (int): The number of new hits.
+            misses (int): The number of new misses.
+            nbytes (int): The change of the cached bytes.
+        '''
+        with self.totals.get_lock():
+            self.totals[0] += hits
+            self.totals[1] += misses
+            self.totals[2] += nbytes
+
+    def read(self, row, start=0, stop=None):
+        '''Method for reading frames start to stop of a single clip
+
+        Input: row, start, stop
+            row (int): The row of the clip in names.
+            start (int): The first frame to read.
+            stop (int): The frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (np.ndarray): The frames of shape (channels, stop - start).
+        '''
+        if not self.cacheable(row):
+            return self.store.read(row, start, stop)
+        # copied so that changes to the returned clip never reach the cache
+        return self.get_clip(row)[..., start:stop].copy()
+
+    def read_into(self, rows, out, starts=None):
+        '''Method for reading a batch of clips into a preallocated buffer. Clip pos is read from
+        frame starts[pos] into out[pos] until either the clip or the buffer runs out of frames.
+        Clips too large for the cache are read from the cached store in one batch.
+
+        Input: rows, out, starts
+            rows (list): The rows of the clips in names.
+            out (np.ndarray): The buffer of shape (batch, channels, frames) to read into.
+            starts (list): The first frame to read from each clip. Default is 0 for every clip.
+
+        Output: num_frames
+            num_frames (np.ndarray): The number of frames read into every row of out.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else np.asarray(starts)
+        num_frames = np.zeros(len(rows), dtype=np.int64)
+        uncached = []
+        for pos, row in enumerate(rows):
+            if not self.cacheable(row):
+                uncached.append(pos)
+                continue
+            clip = self.get_clip(row)[..., starts[pos]:starts[pos] + out.shape[-1]]
+            num_frames[pos] = clip.shape[-1]
+            out[pos, :, :num_frames[pos]] = clip
+        if uncached:
+            buffer = np.zeros((len(uncached),) + out.shape[1:], dtype=out.dtype)
+            num_frames[uncached] = self.store.read_into(rows[uncached], buffer, starts[uncached])
+            out[uncached] = buffer
+        return num_frames
+
+    def cache_info(self):
+        '''Method for reporting the cache statistics of the current process
+
+        Output: info
+            info (dict): The hits, misses, cached clips and cached bytes.
+        '''
+        return {'hits': self.hits, 'misses': self.misses,
+                'clips': len(self.clips), 'bytes': self.nbytes}
+
+    def total_info(self):
+        '''Method for reporting the cache statistics summed over this process and every DataLoader
+        worker reading from a copy of this cache
+
+        Output: info
+            info (dict): The hits, misses and cached bytes of all processes, the bytes of workers
+                         that have exited are still counted.
+        '''
+        with self.totals.get_lock():
+            hits, misses, nbytes = self.totals[:]
+        return {'hits': hits, 'misses': misses, 'bytes': nbytes}
+
+    def close(self):
+        '''Method for closing the cached store, the cached clips are kept'''
+        self.store.close()
+
+    def __getstate__(self):
+        # spawned workers start with an empty cache instead of a pickled copy and share the totals
+        state = dict(self.__dict__)
+        state.update(clips=OrderedDict(), nbytes=0, hits=0, misses=0)
+        return state
+
+
+def unlink_shared_memory(shm, owner):
+    '''Method for removing a shared memory block, only run by the process that created it
+
+    Input: shm, owner
+        shm (SharedMemory): The shared memory block.
+        owner (int): The pid of the process that created the block.
+    '''
+    if os.getpid() == owner:
+        try:
+            shm.close()
+        except BufferError:
+            # tensors still viewing the block keep the mapping alive until they are freed
+            pass
+        shm.unlink()
+
+
+class SharedStore:
+    '''Audio store holding decoded clips in one shared memory block. The clips are read once by the
+    process that builds the store and packed as (frames, channels) in their storage dtype, so
+    compact dtypes take up less shared memory. DataLoader workers
+    then map the same block, whether they are forked or spawned, so that the node holds a single
+    copy of the audio and every read is a zero-copy view. Rows that were not preloaded are read
+    from the wrapped store.
+
+    Args: store, rows
+        store (KeyedStore, PackedStore, MemmapStore or CachedStore): The store to preload from.
+        rows (list): The rows of the clips to preload.
+    '''
+    def __init__(self, store, rows):
+        self.store = store
+        self.names = store.names
+        self.rows = store.rows
+        self.lengths = np.asarray(store.lengths)
+        self.channels = store.channels
+        self.sample_rate = store.sample_rate
+        self.dtype = store.dtype
+        self.scale = store.scale
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        self.offsets = np.full(len(self.names), -1, dtype=np.int64)
+        self.offsets[rows] = np.cumsum(self.lengths[rows]) - self.lengths[rows]
+        self.shape = (int(self.lengths[rows].sum()), self.channels)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(self.shape[0] * self.shape[1] * self.dtype.itemsize, 1))
+        self._finalizer = weakref.finalize(self, unlink_shared_memory, self.shm, os.getpid())
+        self.audio = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        for row in rows:
+            offset = self.offsets[row]
+            self.audio[offset:offset + self.lengths[row]] = store.read(row).T
+        store.close()
+
+    def read(self, row, start=0, stop=None):
+        '''Method for reading frames start to stop of a single clip without copying
+
+        Input: row, start, stop
+            row (int): The row of the clip in names.
+            start (int): The first frame to read.
+            stop (int): The frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (np.ndarray): A view of the frames of shape (channels, stop - start).
+        '''
+        offset = self.offsets[row]
+        if offset < 0:
+            return self.store.read(row, start, stop)
+        stop = self.lengths[row] if stop is None else min(stop, self.lengths[row])
+        return self.audio[offset + start:offset + stop].T
+
+    def read_into(self, rows, out, starts=None):
+        '''Method for reading a batch of clips into a preallocated buffer. Clip pos is read from
+        frame starts[pos] into out[pos] until either the clip or the buffer runs out of frames.
+
+        Input: rows, out, starts
+            rows (list): The rows of the clips in names.
+            out (np.ndarray): The buffer of shape (batch, channels, frames) to read into.
+            starts (list): The first frame to read from each clip. Default is 0 for every clip.
+
+        Output: num_frames
+            num_frames (np.ndarray): The number of frames read into every row of out.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        if (self.offsets[rows] < 0).any():
+            return self.store.read_into(rows, out, starts)
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else np.asarray(starts)
+        num_frames = np.clip(np.minimum(self.lengths[rows] - starts, out.shape[-1]), 0, None)
+        begins = self.offsets[rows] + starts
+        for pos in range(len(rows)):
+            out[pos, :, :num_frames[pos]] = self.audio[begins[pos]:begins[pos] + num_frames[pos]].T
+        return num_frames
+
+    def close(self):
+        '''Method for closing the wrapped store, the shared memory stays mapped'''
+        self.store.close()
+
+    def release(self):
+        '''Method for freeing the shared memory block once no worker reads from it anymore'''
+        self.audio = None
+        self._finalizer()
+
+    def __getstate__(self):
+        # spawned workers attach to the block by name instead of receiving a pickled copy
+        state = dict(self.__dict__)
+        state.update(shm=self.shm.name, audio=None, _finalizer=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        try:
+            self.shm = shared_memory.SharedMemory(name=state['shm'], track=False)
+        except TypeError:
+            # before python 3.13 attaching registers the block with the resource tracker, which
+            # would unlink it as soon as this worker exits. Spawned workers share the tracker of
+            # the creating process, so unregistering afterwards would drop its registration too
+            # and the registration is suppressed instead
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                self.shm = shared_memory.SharedMemory(name=state['shm'])
+            finally:
+                resource_tracker.register = register
+        self.audio = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+
+def open_feature_store(file_path, config_hash):
+    '''Method for opening the features precomputed by the FeatureWriter at file_path
+
+    Input: file_path, config_hash
+        file_path (string): The location of the features .h5 file.
+        config_hash (string): The hash of the feature configuration the features must match.
+
+    Output: store
+        store (PackedStore): The store for reading the features or None when the file is missing
+                             or was computed with a different configuration.
+    '''
+    if not os.path.exists(file_path):
+        return None
+    with h5py.File(file_path, 'r') as frame:
+        stored_hash = frame.attrs.get('config_hash')
+    if isinstance(stored_hash, bytes):
+        stored_hash = stored_hash.decode()
+    if stored_hash != config_hash:
+        return None
+    return PackedStore(file_path, dataset='features')
+
+
+def open_store(file_path):
+    '''Method for opening the audio store written at file_path with the matching backend
+
+    Input: file_path
+        file_path (string): The location of the audio file written by the DataWriter.
+
+    Output: store
+        store (KeyedStore, PackedStore, MemmapStore or ShardedStore): The store of the clips.
+    '''
+    if not h5py.is_hdf5(file_path):
+        # raw files have their index next to them, shard manifests are the index themselves
+        if not os.path.exists(file_path + '.json'):
+            return ShardedStore(file_path)
+        return MemmapStore(file_path)
+    with h5py.File(file_path, 'r') as frame:
+        layout = frame.attrs.get('layout', 'keyed')
+    if isinstance(layout, bytes):
+        layout = layout.decode()
+    if layout == 'packed':
+        return PackedStore(file_path)
+    return KeyedStore(file_path)
@@ -4,43 +4,339 @@ The tools available include a midi file information parser and a sound file pars
 '''
 
 # dependencies
-import random
+import copy
+import os
+import queue
+import threading
+import time
+import warnings
+from functools import partial
 import numpy as np
 import h5py
 from torch.utils.data import Dataset
 from torch.utils.data import DataLoader
+from torch.utils.data import Sampler
 import torch
 
 # user defined modules
 from DataParameters import PARAMETERS as params
+from AudioStore import open_store
+from AudioStore import open_feature_store
+from AudioStore import CachedStore
+from AudioStore import SharedStore
+from AudioStore import rate_path
+from AudioStore import dequantize
+from Features import FeatureExtractor
+from PhilIndex import load_phil_index
+from PhilIndex import select_mask
+from PhilIndex import note_to_midi
 
+# semitones above C of every note name written by the XMLWriter
+NOTE_SEMITONES = {b'rest': 0,
+                  b'C-': -1, b'C': 0, b'C#': 1, b'C##': 2,
+                  b'D-': 1, b'D': 2, b'D#': 3,
+                  b'E-':3, b'E': 4, b'E#': 5,
+                  b'F-': 4, b'F': 5, b'F#': 6, b'F##': 7,
+                  b'G-': 6, b'G': 7, b'G#': 8, b'G##': 9,
+                  b'A-': 8, b'A': 9, b'A#': 10,
+                  b'B--': 9, b'B-': 10, b'B': 11, b'B#': 12}
 
-class RoseEtudes(Dataset):
-    '''Data loader class for reading the Rose Etude data from the .h5 file stored in path.
+
+def notes_to_midi(notes, octaves):
+    '''Method for converting arrays of note names and octaves to midi labels in one pass. Every
+    distinct note name is only looked up once.
+
+    Input: notes, octaves
+        notes (np.ndarray): The byte string note names.
+        octaves (np.ndarray): The octaves of the notes as byte strings or integers.
+
+    Output: midi
+        midi (np.ndarray): The int16 midi notes corresponding to the input.
+    '''
+    names, inverse = np.unique(notes, return_inverse=True)
+    semitones = np.array([NOTE_SEMITONES[name] for name in names], dtype=np.int16)
+    return semitones[inverse.reshape(-1)] + (octaves.astype(np.int16) + 1) * 12
+
+
+class ClipDataset(Dataset):
+    '''Base class of the datasets reading clips from an audio store. It opens the store together
+    with the optional clip cache and spectral front-end. When features are configured, the
+    features precomputed by the FeatureWriter at the audio file location + '.features.h5' are read
+    instead of computing them, as long as they were computed with the same configuration and the
+    requested clips start on a feature frame. Frame counts are always computed from the sample rate
+    stored with the audio, and audio stored in a compact dtype is dequantized to float32 in one
+    pass right after it is read.
+    '''
+    def open_clips(self, file_path, cache_bytes=None, features=None, sample_rate=None):
+        '''Method for opening the audio store, the clip cache and the feature front-end
+
+        Input: file_path, cache_bytes, features, sample_rate
+            file_path (string): The location of the audio file.
+            cache_bytes (int): Byte budget of the clip cache. Default is the cache_bytes parameter.
+            features (dict): The feature configuration. Default is the features parameter.
+            sample_rate (int): The sample rate to read, stored either in file_path or in the file
+                               written next to it for that rate. Default is the sample_rate
+                               parameter, None for the rate of file_path.
+        '''
+        sample_rate = params['sample_rate'] if sample_rate is None else sample_rate
+        if sample_rate and os.path.exists(rate_path(file_path, sample_rate)):
+            file_path = rate_path(file_path, sample_rate)
+        self.file_path = file_path
+        self.store = open_store(file_path)
+        self.sample_rate = self.store.sample_rate
+        if sample_rate and sample_rate != self.sample_rate:
+            raise ValueError('{} holds audio at {} Hz and no {} Hz file was written next to it'
+                             .format(file_path, self.sample_rate, sample_rate))
+        cache_bytes = params['cache_bytes'] if cache_bytes is None else cache_bytes
+        if cache_bytes:
+            self.store = CachedStore(self.store, cache_bytes)
+        features = params['features'] if features is None else features
+        self.features = FeatureExtractor(features, self.sample_rate) if features else None
+        self.feature_store = None
+        if self.features:
+            self.feature_store = open_feature_store(file_path + '.features.h5', self.features.hash)
+        if self.feature_store is not None:
+            self.feature_rows = np.array([self.feature_store.rows.get(name, -1)
+                                          for name in self.store.names], dtype=np.int64)
+            # features missing for some clips are computed for every clip
+            if (self.feature_rows < 0).any():
+                self.feature_store = None
+
+    def stored_features(self, starts):
+        '''Method for checking whether clips starting at starts can be read from the precomputed
+        features
+
+        Input: starts
+            starts (np.ndarray): The first audio frame of every clip.
+
+        Output: stored
+            stored (bool): Whether the features are read from the feature store.
+        '''
+        return (self.feature_store is not None
+                and not (np.asarray(starts) % self.features.hop_length).any())
+
+    def read_clip(self, row, start=0, stop=None):
+        '''Method for reading the audio or the features of frames start to stop of a single clip
+
+        Input: row, start, stop
+            row (int): The row of the clip in the audio store.
+            start (int): The first audio frame to read.
+            stop (int): The audio frame to stop reading at. Default is the end of the clip.
+
+        Output: clip
+            clip (torch.Tensor): The audio of shape (channels, frames) or its features.
+        '''
+        if self.features and self.stored_features([start]):
+            first = start // self.features.hop_length
+            last = None if stop is None else first + self.features.num_frames(stop - start)
+            return torch.from_numpy(np.array(
+                self.feature_store.read(self.feature_rows[row], first, last)))
+        clip = torch.from_numpy(dequantize(self.store.read(row, start, stop), self.store.scale))
+        if self.features:
+            clip = self.features(clip[None])[0]
+        return clip
+
+    def read_clips(self, rows, num_frames, starts=None):
+        '''Method for reading the audio or the features of a batch of clips into one zero padded
+        batch tensor. Clip pos is read from audio frame starts[pos] for at most num_frames frames.
+
+        Input: rows, num_frames, starts
+            rows (np.ndarray): The rows of the clips in the audio store.
+            num_frames (int): The number of audio frames of the batch.
+            starts (np.ndarray): The first audio frame of every clip. Default is 0 for every clip.
+
+        Output: clips, lengths
+            clips (torch.Tensor): The audio of shape (batch, channels, frames) or its features.
+            lengths (np.ndarray): The number of audio or feature frames of every clip before
+                                  padding.
+        '''
+        starts = np.zeros(len(rows), dtype=np.int64) if starts is None else starts
+        if self.features and self.stored_features(starts):
+            clips = torch.zeros(len(rows), *self.feature_store.frame_shape,
+                                self.features.num_frames(num_frames))
+            lengths = self.feature_store.read_into(self.feature_rows[rows], clips.numpy(),
+                                                   starts // self.features.hop_length)
+            return clips, lengths
+        clips = torch.zeros(len(rows), self.store.channels, num_frames)
+        lengths = self.store.read_into(rows, clips.numpy(), starts)
+        if self.store.scale != 1:
+            clips.mul_(self.store.scale)
+        if self.features:
+            clips, lengths = self.features(clips), self.features.num_frames(lengths)
+            # the frames past every clip are zeroed like the padding of the stored features
+            padding = torch.arange(clips.shape[-1]) >= torch.as_tensor(lengths).reshape(
+                -1, *[1] * (clips.dim() - 1))
+            clips.masked_fill_(padding, 0)
+        return clips, lengths
+
+    def cache_info(self):
+        '''Method for reporting the statistics of the clip cache summed over this process and every
+        DataLoader worker
+
+        Output: info
+            info (dict): The hits, misses and cached bytes or None when the clips are not cached.
+        '''
+        store = self.store
+        # the cache may be wrapped by the shared memory of preload
+        while not isinstance(store, CachedStore):
+            store = getattr(store, 'store', None)
+            if store is None:
+                return None
+        return store.total_info()
+
+    def close(self):
+        '''Method for closing the files opened by the current process'''
+        self.store.close()
+        if self.feature_store is not None:
+            self.feature_store.close()
+
+
+class RoseEtudes(ClipDataset):
+    '''Data loader class for reading the Rose Etude data from the .h5 file stored in path. The data
+    file may be written in any layout of the DataWriter, or be a VirtualWriter master file over
+    packed shards. By default every etude yields its first sound_duration seconds together with all
+    of its labels. In windowed mode every etude is split into windows of sound_duration seconds
+    that start every hop_duration seconds, and the labels of a window are the notes sounding inside
+    of it.
 
     Args: path
         path (string): The location of the Rose Etudes .h5 files.
         data_name (string): Name of the Rose Etudes data .h5 file.
         labels_name (string): Name of the Rose Etudes label .h5 file.
+        windowed (bool): Whether to split the etudes into windows. Default is False.
+        hop_duration (float): Seconds between the starts of two windows, shorter than
+                              sound_duration for overlapping windows.
+                              Default is sound_duration.
+        random_offset (bool): Whether to shift every window by a random offset of up to
+                              hop_duration seconds each time it is read. Default is False.
+        cache_bytes (int): Byte budget of the in-process LRU cache of decoded etudes, 0 disables
+                           the cache. Default is the cache_bytes parameter.
+        features (dict): Configuration of the spectral features returned instead of the audio,
+                         None for raw audio. Default is the features parameter.
+        sample_rate (int): The sample rate of the audio to read. Default is the sample_rate
+                           parameter.
     '''
-    def __init__(self, path, data_name, labels_name):
-        self.rose_data_frame = h5py.File(path + data_name, 'r')
-        self.rose_data_keys = list(self.rose_data_frame.keys())
-        self.rose_labels_frame = h5py.File(path + labels_name, 'r')
-        self.rose_labels_keys = list(self.rose_labels_frame.keys())
+    def __init__(self, path, data_name, labels_name, windowed=False, hop_duration=None,
+                 random_offset=False, cache_bytes=None, features=None, sample_rate=None):
+        self.open_clips(path + data_name, cache_bytes, features, sample_rate)
+        # the etudes are paired with their labels by the sorted order of their names
+        self.rose_data_keys = sorted(self.store.names)
+        self.rose_data_rows = np.array([self.store.rows[key] for key in self.rose_data_keys],
+                                       dtype=np.int64)
+        # convert every label once into one flat int16 tensor, etude idx owns the values
+        # from label_offsets[idx] to label_offsets[idx + 1]
+        with h5py.File(path + labels_name, 'r') as labels_frame:
+            self.rose_labels_keys = list(labels_frame.keys())
+            rose_labels = [labels_frame[key][:, 2:5] for key in self.rose_labels_keys]
+        self.label_offsets = np.cumsum([0] + [len(labels) for labels in rose_labels])
+        # the start and end of every note as a fraction of its etude assuming a steady tempo
+        self.label_starts, self.label_ends = [], []
+        for labels in rose_labels:
+            ends = np.cumsum(labels[:, 0].astype(np.float64))
+            total = ends[-1] if len(ends) and ends[-1] > 0 else 1.0
+            self.label_starts.append((ends - labels[:, 0].astype(np.float64)) / total)
+            self.label_ends.append(ends / total)
+        rose_labels = (np.concatenate(rose_labels) if rose_labels
+                       else np.zeros((0, 3), dtype='S5'))
+        self.label_values = torch.from_numpy(notes_to_midi(rose_labels[:, 1], rose_labels[:, 2]))
         # the number of frames to include from the file
-        self.num_frames = int(params['sound_duration'] * 44100)
+        self.num_frames = int(params['sound_duration'] * self.sample_rate)
+        self.windowed = windowed
+        self.random_offset = random_offset
+        self.hop_frames = int((hop_duration or params['sound_duration']) * self.sample_rate)
+        # every window is an etude and the frame it starts at
+        if windowed:
+            lengths = self.store.lengths[self.rose_data_rows]
+            counts = np.where(lengths > self.num_frames,
+                              1 + (lengths - self.num_frames) // self.hop_frames, 1)
+            self.window_etudes = np.repeat(np.arange(len(counts)), counts)
+            first_window = np.repeat(np.cumsum(counts) - counts, counts)
+            self.window_starts = (np.arange(counts.sum()) - first_window) * self.hop_frames
+        else:
+            self.window_etudes = np.arange(len(self.rose_data_rows))
+            self.window_starts = np.zeros(len(self.rose_data_rows), dtype=np.int64)
+        # the files are reopened lazily by whichever process reads from them
+        self.close()
 
     def __len__(self):
-        return len(self.rose_data_keys)
+        return len(self.window_etudes)
 
     def __getitem__(self, idx):
-        rose_data = torch.from_numpy(
-            self.rose_data_frame[self.rose_data_keys[idx]][:self.num_frames])
-        rose_labels = self.rose_labels_frame[self.rose_labels_keys[idx]][:, 3:5]
-        rose_labels = torch.tensor([self.name_to_midi(note, octave) for note, octave in
-                                    zip(rose_labels[:, 0], rose_labels[:, 1])])
-        return rose_data, rose_labels
+        start = self.get_start(idx)
+        rose_data = self.read_clip(self.rose_data_rows[self.window_etudes[idx]], start,
+                                   start + self.num_frames)
+        return rose_data, self.get_labels(idx, start)
+
+    def __getitems__(self, indices):
+        '''Method for reading a whole batch at once. The windows are read in on-disk order straight
+        into one zero padded batch tensor of shape (batch, channels, num_frames).
+
+        Input: indices
+            indices (list): The dataset indices in the batch.
+
+        Output: rose_data, rose_labels, lengths
+            rose_data (torch.Tensor): The batch of audio clips or of their features.
+            rose_labels (list): The midi label tensor of every clip in the batch.
+            lengths (torch.Tensor): The number of audio or feature frames of every clip before
+                                    padding.
+        '''
+        starts = np.array([self.get_start(idx) for idx in indices], dtype=np.int64)
+        rose_data, lengths = self.read_clips(self.rose_data_rows[self.window_etudes[list(indices)]],
+                                             self.num_frames, starts)
+        rose_labels = [self.get_labels(idx, start) for idx, start in zip(indices, starts)]
+        return rose_data, rose_labels, torch.from_numpy(lengths)
+
+    @property
+    def lengths(self):
+        '''The number of frames of every window without random offsets'''
+        etude_lengths = self.store.lengths[self.rose_data_rows[self.window_etudes]]
+        return np.clip(np.minimum(etude_lengths - self.window_starts, self.num_frames), 0, None)
+
+    def get_start(self, idx):
+        '''Method for retrieving the first frame of a window, shifted by a random offset in
+        random_offset mode without running past the end of the etude
+
+        Input: idx
+            idx (int): The dataset index of the window.
+
+        Output: start
+            start (int): The first frame of the window.
+        '''
+        start = int(self.window_starts[idx])
+        if self.windowed and self.random_offset:
+            # torch generators are reseeded in every DataLoader worker unlike numpy's
+            length = int(self.store.lengths[self.rose_data_rows[self.window_etudes[idx]]])
+            start = min(start + int(torch.randint(self.hop_frames, ())),
+                        max(length - self.num_frames, 0))
+        return start
+
+    def get_labels(self, idx, start=0):
+        '''Method for retrieving the midi labels of a window. Outside of windowed mode these are
+        the labels of the whole etude.
+
+        Input: idx, start
+            idx (int): The dataset index of the window.
+            start (int): The first frame of the window.
+
+        Output: rose_labels
+            rose_labels (torch.Tensor): The int16 midi notes played in the window.
+        '''
+        etude = self.window_etudes[idx]
+        first, last = self.label_offsets[etude], self.label_offsets[etude + 1]
+        if self.windowed:
+            # the notes ending after the window starts and starting before it ends
+            length = self.store.lengths[self.rose_data_rows[etude]]
+            last = first + np.searchsorted(self.label_starts[etude],
+                                           (start + self.num_frames) / length, 'left')
+            first = first + np.searchsorted(self.label_ends[etude], start / length, 'right')
+        return self.label_values[first:last]
+
+    def preload(self):
+        '''Method for loading every etude into shared memory once so that all DataLoader workers
+        read the same copy without touching the audio file'''
+        if not isinstance(self.store, SharedStore):
+            self.store = SharedStore(self.store, self.rose_data_rows)
+
     def name_to_midi(self, note, octave):
         '''Method for converting between note names and midi labels
 
@@ -51,62 +347,106 @@ class RoseEtudes(Dataset):
         Output: midi
             midi (int): The midi note corresponding to the input.
         '''
-        name = {b'rest': 0,
-                b'C-': -1, b'C': 0, b'C#': 1, b'C##': 2,
-                b'D-': 1, b'D': 2, b'D#': 3,
-                b'E-':3, b'E': 4, b'E#': 5,
-                b'F-': 4, b'F': 5, b'F#': 6, b'F##': 7,
-                b'G-': 6, b'G': 7, b'G#': 8, b'G##': 9,
-                b'A-': 8, b'A': 9, b'A#': 10,
-                b'B--': 9, b'B-': 10, b'B': 11, b'B#': 12}
-        midi = name[note] + (int(octave) + 1) * 12
+        midi = NOTE_SEMITONES[note] + (int(octave) + 1) * 12
         return midi
 
 
-class Philharmonia(Dataset):
-    '''Data loader class for reading the Philharmonia data from the .h5 file stored in path.
+# monophonic, dynamically stable sounds played normally on the clarinet
+CLARINET_QUERY = {'instrument': 'clarinet',
+                  'duration': lambda dur: 'phrase' not in dur and 'long' not in dur,
+                  'dynamic': lambda dyn: 'cresc' not in dyn,
+                  'style': lambda style: 'normal' in style}
+
+
+class Philharmonia(ClipDataset):
+    '''Data loader class for reading the Philharmonia data from the .h5 file stored in path. The
+    file may be written in any layout of the DataWriter, or be a VirtualWriter master file over
+    packed shards.
 
     Args: path
         path (string): The location of the Philharmonia .h5 file.
         name (string): Name of the Philharmonia .h5 file.
+        cache_bytes (int): Byte budget of the in-process LRU cache of decoded clips, 0 disables
+                           the cache. Default is the cache_bytes parameter.
+        features (dict): Configuration of the spectral features returned instead of the audio,
+                         None for raw audio. Default is the features parameter.
+        sample_rate (int): The sample rate of the audio to read. Default is the sample_rate
+                           parameter.
     '''
-    def __init__(self, path, name):
-        self.phil_frame = h5py.File(path + name, 'r')
-        phil_keys = np.array(list(self.phil_frame.keys()))
-        # shuffle the keys so as to not bias the input data
-        random.Random(4).shuffle(phil_keys)
-        '''
-        Information from the key names separated by the '_' delimiter:.
-        Index 0: instrument (banjo, bass-clarinet, bassoon, ..., violin).
-        Index 1: midi note (22, 23,24, ..., 108).
-        Index 2: duration (025, 05, 1, ..., very long).
-        Index 3: dynamics (pianissimo, piano, mezzo-piano, ... fortissimo).
-        Index 4: style (normal, fluttertonguing, nonlegato, ..., glissando).
-        '''
-        information = np.array([key.split('_') for key in phil_keys])
-        # only include samples with monophonic, dynamically stable sounds
-        # played normally on the clarinet,
-        useful_samples = [(inst == 'clarinet' and 'phrase' not in dur
-                           and 'long' not in dur and 'cresc' not in dyn
-                           and 'normal' in style)
-                          for inst, dur, dyn, style in zip(information[:, 0],
-                                                           information[:, 2],
-                                                           information[:, 3],
-                                                           information[:, 4])]
-        self.phil_keys = phil_keys[useful_samples]
-        self.information = information[useful_samples]
-        # the labels are the note names
-        self.labels = torch.tensor([
-            self.name_to_midi(info) for info in self.information[:, 1]]).long()
+    def __init__(self, path, name, cache_bytes=None, features=None, sample_rate=None):
+        self.open_clips(path + name, cache_bytes, features, sample_rate)
+        self.index, self.categories = load_phil_index(self.file_path, self.store)
+        # the names are converted once and shared by every selected view
+        self.store_names = np.array(self.store.names)
+        self.use_rows(select_mask(self.index, self.categories, **CLARINET_QUERY))
+        # the files are reopened lazily by whichever process reads from them
+        self.close()
 
     def __len__(self):
         return len(self.phil_keys)
 
     def __getitem__(self, idx):
-        phil_data = torch.from_numpy(
-            self.phil_frame[self.phil_keys[idx]][:]).float()
+        phil_data = self.read_clip(self.phil_rows[idx])
         phil_labels = self.labels[idx].long()
         return phil_data, phil_labels
+
+    def __getitems__(self, indices):
+        '''Method for reading a whole batch at once. The clips are read in on-disk order straight
+        into one batch tensor that is zero padded to the longest clip in the batch.
+
+        Input: indices
+            indices (list): The dataset indices in the batch.
+
+        Output: phil_data, phil_labels, lengths
+            phil_data (torch.Tensor): The batch of clips of shape (batch, channels, frames) or of
+                                      their features.
+            phil_labels (torch.Tensor): The midi label of every clip in the batch.
+            lengths (torch.Tensor): The number of audio or feature frames of every clip before
+                                    padding.
+        '''
+        phil_data, lengths = self.read_clips(self.phil_rows[list(indices)],
+                                             int(self.lengths[list(indices)].max()))
+        phil_labels = self.labels[list(indices)]
+        return phil_data, phil_labels, torch.from_numpy(lengths)
+
+    def select(self, instrument=None, duration=None, dynamic=None, style=None, pitch_range=None):
+        '''Method for selecting a subset of the whole sample library. The query is evaluated as
+        boolean masks over the coded metadata index and the returned view shares the audio store
+        and the index of this dataset. See PhilIndex.select_mask for the form of the conditions.
+
+        Input: instrument, duration, dynamic, style, pitch_range
+            instrument, duration, dynamic, style (string, collection or callable): The conditions
+                on the categorical fields.
+            pitch_range (tuple): The lowest and highest midi note to include.
+
+        Output: view
+            view (Philharmonia): The dataset of the selected samples.
+        '''
+        view = copy.copy(self)
+        view.use_rows(select_mask(self.index, self.categories, instrument=instrument,
+                                  duration=duration, dynamic=dynamic, style=style,
+                                  pitch_range=pitch_range))
+        return view
+
+    def use_rows(self, mask):
+        '''Method for restricting the dataset to the index records selected by mask
+
+        Input: mask
+            mask (np.ndarray): Boolean mask over the index records.
+        '''
+        self.phil_rows = np.array(self.index['row'][mask], dtype=np.int64)
+        self.lengths = np.array(self.index['length'][mask], dtype=np.int64)
+        self.phil_keys = self.store_names[self.phil_rows]
+        # the labels are the note names
+        self.labels = torch.from_numpy(np.array(self.index['midi'][mask], dtype=np.int64))
+
+    def preload(self):
+        '''Method for loading the selected clips into shared memory once so that all DataLoader
+        workers read the same copy without touching the audio file. Views selected afterwards
+        read the clips outside of this selection from the audio file.'''
+        if not isinstance(self.store, SharedStore):
+            self.store = SharedStore(self.store, self.phil_rows)
+
     def name_to_midi(self, note):
         '''Method for converting note name labels to midi labels
         Input: note
@@ -115,27 +455,281 @@ class Philharmonia(Dataset):
         Output: midi
             midi (int): output midi note
         '''
-        note_names = 'C Cs D Ds E F Fs G Gs A As B'.split(' ')
-        midi = (note_names.index(note[:-1]))+(int(note[-1])+1)*12
-        return midi
+        return note_to_midi(note)
 
-DATASETS = {'Rose Etudes': RoseEtudes('../data/audio_data/', 'Rose_Data.h5', 'Rose_Labels.h5'),
-            'Philharmonia': Philharmonia('../data/audio_data/', 'Phil.h5')}
+# registry of dataset factories, nothing is opened or parsed until a dataset is requested
+DATASETS = {'Rose Etudes': partial(RoseEtudes, '../data/audio_data/', 'Rose_Data.h5', 'Rose_Labels.h5'),
+            'Rose Etudes Windows': partial(RoseEtudes, '../data/audio_data/', 'Rose_Data.h5',
+                                           'Rose_Labels.h5', windowed=True, random_offset=True),
+            'Philharmonia': partial(Philharmonia, '../data/audio_data/', 'Phil.h5')}
+# datasets that have already been built in this process
+_BUILT_DATASETS = {}
 
 
-def get_loader(dataset, batch_size=1, shuffle=False,
-               sampler=None, batch_sampler=None, num_workers=0,
-               pin_memory=False, drop_last=False, timeout=0, worker_init_fn=None):
-    '''Method for loading datasets with batching, samplers, and collate functions'''
+def load_dataset(dataset):
+    '''Method for building a registered dataset on first use. Datasets are memoized so that every
+    later request in the same process reuses the already built dataset. Datasets that are already
+    built, such as the views returned by Philharmonia.select, are passed through.
+
+    Input: dataset
+        dataset (string or Dataset): Name of the dataset in DATASETS or a built dataset.
+
+    Output: data
+        data (Dataset): The built dataset.
+    '''
+    if isinstance(dataset, Dataset):
+        return dataset
+    if dataset not in _BUILT_DATASETS:
+        _BUILT_DATASETS[dataset] = DATASETS[dataset]()
+    return _BUILT_DATASETS[dataset]
+
+
+class BucketBatchSampler(Sampler):
+    '''Batch sampler grouping samples of similar length so that little of every batch is padding.
+    The samples are shuffled, split into pools of pool_size samples and every pool is sorted by
+    length before it is cut into batches of either batch_size samples or as many samples as fit
+    into max_frames padded frames. The order of the batches is shuffled again.
+
+    Args: lengths, batch_size, max_frames, shuffle, drop_last, pool_size
+        lengths (np.ndarray): The number of frames of every sample in the dataset.
+        batch_size (int): The number of samples in every batch.
+        max_frames (int): The budget of padded frames (batch size times longest sample) of every
+                          batch, used instead of batch_size.
+        shuffle (bool): Whether to shuffle the samples and batches every epoch. Default is True.
+        drop_last (bool): Whether to drop the batches of every pool with fewer than batch_size
+                          samples. Default is False.
+        pool_size (int): The number of samples sorted together when shuffling. Default is 4096.
+    '''
+    def __init__(self, lengths, batch_size=None, max_frames=None, shuffle=True, drop_last=False,
+                 pool_size=4096):
+        if (batch_size is None) == (max_frames is None):
+            raise ValueError('exactly one of batch_size and max_frames has to be given')
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_frames = max_frames
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pool_size = pool_size if shuffle else max(len(self.lengths), 1)
+        # the batches of the next epoch once they were counted by __len__
+        self._next_batches = None
+
+    def make_batches(self):
+        '''Method for cutting the samples of one epoch into batches
+
+        Output: batches
+            batches (list): The dataset indices of every batch.
+        '''
+        if self.shuffle:
+            order = torch.randperm(len(self.lengths)).numpy()
+        else:
+            order = np.arange(len(self.lengths))
+        batches = []
+        for pool_start in range(0, len(order), self.pool_size):
+            pool = order[pool_start:pool_start + self.pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batch, longest = [], 0
+            for idx in pool.tolist():
+                longest = max(longest, self.lengths[idx])
+                if batch and (len(batch) == self.batch_size if self.batch_size else
+                              longest * (len(batch) + 1) > self.max_frames):
+                    batches.append(batch)
+                    batch, longest = [], self.lengths[idx]
+                batch.append(idx)
+            if batch and not (self.drop_last and self.batch_size and len(batch) < self.batch_size):
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[pos] for pos in torch.randperm(len(batches)).tolist()]
+        return batches
+
+    def __iter__(self):
+        batches = self._next_batches if self._next_batches is not None else self.make_batches()
+        self._next_batches = None
+        return iter(batches)
+
+    def __len__(self):
+        if self._next_batches is None:
+            self._next_batches = self.make_batches()
+        return len(self._next_batches)
+
+
+def pad_collate(batch):
+    '''Method for collating samples of different lengths. The audio is zero padded to the longest
+    sample in the batch and the labels are stacked when they all have the same shape.
+
+    Input: batch
+        batch (list): The (data, labels) samples.
 
-    loader = DataLoader(dataset=DATASETS[dataset],
+    Output: data, labels, lengths
+        data (torch.Tensor): The padded audio of shape (batch, channels, frames).
+        labels (torch.Tensor or list): The labels of every sample.
+        lengths (torch.Tensor): The number of frames of every sample before padding.
+    '''
+    lengths = torch.tensor([data.shape[-1] for data, _ in batch])
+    padded = torch.zeros(len(batch), *batch[0][0].shape[:-1], int(lengths.max()),
+                         dtype=batch[0][0].dtype)
+    for pos, (data, _) in enumerate(batch):
+        padded[pos, ..., :data.shape[-1]] = data
+    labels = [labels for _, labels in batch]
+    if all(label.shape == labels[0].shape for label in labels):
+        labels = torch.stack(labels)
+    return padded, labels, lengths
+
+
+def collate_batch(batch):
+    '''Method for collating batches. Batches read through __getitems__ are already collated and
+    are passed through untouched, lists of single samples are padded with pad_collate.
+
+    Input: batch
+        batch (tuple or list): A collated batch or a list of samples.
+
+    Output: batch
+        batch (tuple): The collated batch.
+    '''
+    if isinstance(batch, tuple):
+        return batch
+    return pad_collate(batch)
+
+
+def pin_batch(batch):
+    '''Method for copying every tensor of a batch into page locked memory
+
+    Input: batch
+        batch (torch.Tensor, list or tuple): The batch to pin.
+
+    Output: batch
+        batch (torch.Tensor, list or tuple): The pinned batch.
+    '''
+    if isinstance(batch, torch.Tensor):
+        return batch.pin_memory()
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(pin_batch(item) for item in batch)
+    return batch
+
+
+class PrefetchLoader:
+    '''Wrapper assembling the next batches of a DataLoader on a background thread while the
+    current batch is consumed. The batches are pinned on the same thread when pin_memory is set and
+    a GPU is available, torch recycles the pinned blocks of consumed batches for the following
+    ones. The loader counts how often and for how long the consumer had to wait for a batch.
+
+    Args: loader, depth, pin_memory
+        loader (DataLoader): The loader to prefetch from.
+        depth (int): The number of batches to keep ready. Default is 2.
+        pin_memory (bool): Whether to pin the prefetched batches. Default is False.
+    '''
+    def __init__(self, loader, depth=2, pin_memory=False):
+        self.loader = loader
+        self.depth = depth
+        self.pin_memory = pin_memory
+        if pin_memory and not torch.cuda.is_available():
+            # pinning needs a GPU driver, the DataLoader warns and skips it in the same way
+            warnings.warn('pin_memory is set but no GPU is available, the batches are not pinned')
+            self.pin_memory = False
+        self.batches = 0
+        self.waits = 0
+        self.wait_time = 0.
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        ready = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for batch in self.loader:
+                    if self.pin_memory:
+                        batch = pin_batch(batch)
+                    while not stop.is_set():
+                        try:
+                            ready.put(batch, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                batch = done
+            except Exception as error:  # handed over to the consumer and raised there
+                batch = error
+            while not stop.is_set():
+                try:
+                    ready.put(batch, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                try:
+                    batch = ready.get_nowait()
+                except queue.Empty:
+                    self.waits += 1
+                    start = time.perf_counter()
+                    batch = ready.get()
+                    self.wait_time += time.perf_counter() - start
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                self.batches += 1
+                yield batch
+        finally:
+            # let the producer exit when the consumer stops early
+            stop.set()
+
+    def prefetch_info(self):
+        '''Method for reporting how often the consumer waited for a batch
+
+        Output: info
+            info (dict): The batches consumed, the waits and the total seconds spent waiting.
+        '''
+        return {'batches': self.batches, 'waits': self.waits, 'wait_time': self.wait_time}
+
+
+def get_loader(dataset, batch_size=1, shuffle=False,
+               sampler=None, batch_sampler=None, num_workers=0, collate_fn=collate_batch,
+               pin_memory=False, drop_last=False, timeout=0, worker_init_fn=None, preload=False,
+               bucket=False, max_frames=None, prefetch=0, persistent_workers=None):
+    '''Method for loading datasets with batching, samplers, and collate functions. The dataset is
+    either the name of a registered dataset or a built one, such as a Philharmonia.select view.
+    With preload the audio of the dataset is loaded into shared memory by this process before any
+    worker starts. With bucket or max_frames the batches are drawn by a BucketBatchSampler,
+    holding either batch_size samples of similar length or as many as fit into max_frames padded
+    frames.
+    With prefetch the loader is wrapped in a PrefetchLoader keeping prefetch batches ready. The
+    workers persist across epochs by default when the dataset caches clips, so that their caches
+    are kept, and dataset.cache_info() reports the cache statistics of all of them.'''
+    data = load_dataset(dataset)
+    if bucket or max_frames:
+        batch_sampler = BucketBatchSampler(data.lengths,
+                                           batch_size=None if max_frames else batch_size,
+                                           max_frames=max_frames, shuffle=shuffle,
+                                           drop_last=drop_last)
+        batch_size, shuffle, drop_last = 1, False, False
+    if preload:
+        data.preload()
+    if persistent_workers is None:
+        # new workers would start every epoch with an empty cache
+        persistent_workers = num_workers > 0 and data.cache_info() is not None
+    if num_workers > 0:
+        # make sure no open handle is inherited by the workers, each one opens its own
+        data.close()
+    loader = DataLoader(dataset=data,
                         batch_size=batch_size,
                         shuffle=shuffle,
                         sampler=sampler,
                         batch_sampler=batch_sampler,
                         num_workers=num_workers,
-                        pin_memory=pin_memory,
+                        collate_fn=collate_fn,
+                        pin_memory=pin_memory and not prefetch,
                         drop_last=drop_last,
                         timeout=timeout,
-                        worker_init_fn=worker_init_fn)
+                        worker_init_fn=worker_init_fn,
+                        persistent_workers=persistent_workers)
+    if prefetch:
+        loader = PrefetchLoader(loader, depth=prefetch, pin_memory=pin_memory)
     return loader
@@ -4,4 +4,11 @@ datasets.
 '''
 
 PARAMETERS = {'sound_duration': 5.00, # duration in seconds
+              'sample_rate': None, # sample rate of the audio files to read, None for the rate they
+                                   # were written at, other rates are read from the files written
+                                   # next to them by the DataWriter
+              'cache_bytes': 0, # byte budget of the decoded clip cache of every process, so the
+                                # caches take up to cache_bytes times num_workers, 0 disables it
+              'features': None, # spectral feature configuration, see Features.FEATURE_DEFAULTS
+                                # for example {'type': 'mel', 'n_mels': 128}, None for raw audio
 }
\ No newline at end of file
@@ -0,0 +1,244 @@
+'''
+This module stores the spectral front-end of the data loaders. The features are computed with torch
+for a whole batch of audio at once, and the windows and filterbanks are built once per extractor
+so that the DataLoader workers only ever run the transforms themselves. The constant-Q transform is
+computed one octave at a time: the kernel of the top octave is applied to the audio, which is then
+low-pass filtered and decimated by 2 for the next octave, so that the frame size of every stft is
+set by the top octave instead of by the lowest bin.
+'''
+
+# dependencies
+import hashlib
+import json
+import math
+import numpy as np
+import torch
+
+# the settings used for every key missing from a feature configuration
+FEATURE_DEFAULTS = {'type': 'mel',  # one of 'stft', 'mel' or 'cqt'
+                    'n_fft': 2048,  # stft and mel frame size in samples
+                    'hop_length': 512,  # samples between the centers of two frames
+                    'n_mels': 128,  # number of mel bands
+                    'fmin': 32.70,  # lowest mel or cqt frequency in Hz
+                    'fmax': None,  # highest mel frequency in Hz, None for the Nyquist frequency
+                    'n_bins': 84,  # number of cqt bins
+                    'bins_per_octave': 12,  # cqt bins in every octave
+                    'power': 2.0,  # exponent of the stft and mel magnitudes
+                    'log': True}  # whether to return log features
+
+# the version of every feature type, stored features of an older version are recomputed
+FEATURE_VERSIONS = {'stft': 1, 'mel': 1, 'cqt': 2}
+# the half length in taps and the cutoff in cycles per input sample of the decimation filter of
+# the cqt, whose transition band ends just below the Nyquist frequency of the decimated audio
+DECIMATION_TAPS = 64
+DECIMATION_CUTOFF = 0.225
+
+
+def hz_to_mel(freq):
+    '''Method for converting frequencies to the mel scale
+
+    Input: freq
+        freq (float or np.ndarray): The frequencies in Hz.
+
+    Output: mel
+        mel (float or np.ndarray): The frequencies in mel.
+    '''
+    return 2595.0 * np.log10(1.0 + np.asarray(freq) / 700.0)
+
+
+def mel_to_hz(mel):
+    '''Method for converting mel scale values to frequencies
+
+    Input: mel
+        mel (float or np.ndarray): The frequencies in mel.
+
+    Output: freq
+        freq (float or np.ndarray): The frequencies in Hz.
+    '''
+    return 700.0 * (10.0 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+
+def mel_filterbank(sample_rate, n_fft, n_mels, fmin, fmax):
+    '''Method for building a matrix of triangular mel filters over the stft frequency bins
+
+    Input: sample_rate, n_fft, n_mels, fmin, fmax
+        sample_rate (int): The sample rate of the audio.
+        n_fft (int): The stft frame size.
+        n_mels (int): The number of mel bands.
+        fmin (float): The lowest frequency in Hz.
+        fmax (float): The highest frequency in Hz.
+
+    Output: filterbank
+        filterbank (torch.Tensor): The filters of shape (n_mels, n_fft // 2 + 1).
+    '''
+    bins = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+    edges = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bins - lower) / (center - lower)
+    falling = (upper - bins) / (upper - center)
+    return torch.from_numpy(np.maximum(0, np.minimum(rising, falling)).astype(np.float32))
+
+
+def cqt_kernel(sample_rate, fmin, n_bins, bins_per_octave):
+    '''Method for building the spectral kernel of a constant-Q transform. Every bin is a Hann
+    windowed complex exponential whose length holds the same number of periods for every bin,
+    centered in a frame long enough for the lowest bin and transformed to the frequency domain.
+
+    Input: sample_rate, fmin, n_bins, bins_per_octave
+        sample_rate (int): The sample rate of the audio.
+        fmin (float): The center frequency of the lowest bin in Hz.
+        n_bins (int): The number of bins.
+        bins_per_octave (int): The number of bins in every octave.
+
+    Output: kernel, n_fft
+        kernel (torch.Tensor): The conjugated complex kernel of shape (n_fft // 2 + 1, n_bins).
+        n_fft (int): The frame size of the kernel.
+    '''
+    quality = 1.0 / (2.0 ** (1.0 / bins_per_octave) - 1.0)
+    freqs = fmin * 2.0 ** (np.arange(n_bins) / bins_per_octave)
+    lengths = np.ceil(quality * sample_rate / freqs).astype(np.int64)
+    n_fft = 2 ** int(math.ceil(math.log2(lengths.max())))
+    kernel = np.zeros((n_bins, n_fft), dtype=np.complex128)
+    for num_bin, (freq, length) in enumerate(zip(freqs, lengths)):
+        times = np.arange(length) - length // 2
+        atom = np.hanning(length) * np.exp(2j * np.pi * freq * times / sample_rate) / length
+        start = n_fft // 2 - length // 2
+        kernel[num_bin, start:start + length] = atom
+    # Parseval: <x, a> = <X, A> / n_fft, only the positive frequencies of the atoms are kept
+    kernel = np.conj(np.fft.fft(kernel, axis=1)[:, :n_fft // 2 + 1]) / n_fft
+    return torch.from_numpy(kernel.T.astype(np.complex64)), n_fft
+
+
+def decimation_filter():
+    '''Method for building the Kaiser windowed sinc low-pass filter applied before the audio is
+    decimated by 2 for the next cqt octave
+
+    Output: taps
+        taps (torch.Tensor): The filter taps of shape (1, 1, 2 * DECIMATION_TAPS + 1).
+    '''
+    times = np.arange(-DECIMATION_TAPS, DECIMATION_TAPS + 1)
+    taps = 2 * DECIMATION_CUTOFF * np.sinc(2 * DECIMATION_CUTOFF * times)
+    taps *= np.kaiser(len(times), 8.6)
+    return torch.from_numpy((taps / taps.sum()).astype(np.float32)).reshape(1, 1, -1)
+
+
+def config_hash(config, sample_rate):
+    '''Method for hashing a feature configuration so that stored features can be matched to it
+
+    Input: config, sample_rate
+        config (dict): The feature configuration.
+        sample_rate (int): The sample rate of the audio.
+
+    Output: digest
+        digest (string): The hex digest of the complete configuration.
+    '''
+    config = dict(FEATURE_DEFAULTS, **config, sample_rate=sample_rate)
+    config['version'] = FEATURE_VERSIONS[config['type']]
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class FeatureExtractor:
+    '''Batched spectral front-end computing stft, mel or cqt features of audio batches of shape
+    (batch, channels, frames). The frames are centered on every hop_length sample, so a clip of n
+    samples has 1 + n // hop_length feature frames.
+
+    Args: config, sample_rate
+        config (dict): The feature configuration, see FEATURE_DEFAULTS.
+        sample_rate (int): The sample rate of the audio.
+    '''
+    def __init__(self, config, sample_rate):
+        self.config = dict(FEATURE_DEFAULTS, **config)
+        self.sample_rate = sample_rate
+        self.hash = config_hash(config, sample_rate)
+        self.hop_length = self.config['hop_length']
+        if self.config['type'] == 'cqt':
+            self.init_cqt()
+        else:
+            self.n_fft = self.config['n_fft']
+            self.window = torch.hann_window(self.n_fft)
+        if self.config['type'] == 'mel':
+            self.filterbank = mel_filterbank(sample_rate, self.n_fft, self.config['n_mels'],
+                                             self.config['fmin'],
+                                             self.config['fmax'] or sample_rate / 2)
+
+    def init_cqt(self):
+        '''Method for building the kernel of the top cqt octave, which every lower octave applies
+        to audio decimated by 2 once more than the octave above it'''
+        n_bins, bins_per_octave = self.config['n_bins'], self.config['bins_per_octave']
+        self.n_octaves = -(-n_bins // bins_per_octave)
+        self.octave_bins = min(n_bins, bins_per_octave)
+        top_fmin = self.config['fmin'] * 2.0 ** ((n_bins - self.octave_bins) / bins_per_octave)
+        fmax = self.config['fmin'] * 2.0 ** ((n_bins - 1) / bins_per_octave)
+        # the bins of every lower octave have to stay in the passband of the decimation filter
+        limit = self.sample_rate / 2 if self.n_octaves == 1 else 0.4 * self.sample_rate
+        if fmax >= limit:
+            raise ValueError('the highest cqt bin at {:.0f} Hz has to stay below {:.0f} Hz at a '
+                             'sample rate of {}'.format(fmax, limit, self.sample_rate))
+        if self.hop_length % 2 ** (self.n_octaves - 1):
+            raise ValueError('the hop_length of a cqt over {} octaves has to be a multiple of {}'
+                             .format(self.n_octaves, 2 ** (self.n_octaves - 1)))
+        self.kernel, self.n_fft = cqt_kernel(self.sample_rate, top_fmin, self.octave_bins,
+                                             bins_per_octave)
+        self.window = torch.ones(self.n_fft)
+        self.decimation = decimation_filter()
+
+    def cqt(self, audio):
+        '''Method for computing the cqt magnitudes of a batch of audio octave by octave
+
+        Input: audio
+            audio (torch.Tensor): The audio of shape (batch, frames).
+
+        Output: features
+            features (torch.Tensor): The magnitudes of shape (batch, n_bins, frames).
+        '''
+        num_frames = 1 + audio.shape[-1] // self.hop_length
+        hop_length, octaves = self.hop_length, []
+        for octave in range(self.n_octaves):
+            spectrum = torch.stft(audio, self.n_fft, hop_length=hop_length, window=self.window,
+                                  center=True, pad_mode='constant', return_complex=True)
+            features = torch.matmul(spectrum.transpose(1, 2), self.kernel).abs().transpose(1, 2)
+            # the lowest octave holds only the bins left over
+            bins = min(self.octave_bins, self.config['n_bins'] - octave * self.octave_bins)
+            octaves.append(features[:, self.octave_bins - bins:, :num_frames])
+            if octave + 1 < self.n_octaves:
+                # frame t stays centered on sample t * hop_length of the original audio
+                audio = torch.nn.functional.conv1d(
+                    audio[:, None], self.decimation, stride=2,
+                    padding=DECIMATION_TAPS)[:, 0]
+                hop_length //= 2
+        return torch.cat(octaves[::-1], dim=1)
+
+    def num_frames(self, lengths):
+        '''Method for converting clip lengths in samples to lengths in feature frames
+
+        Input: lengths
+            lengths (torch.Tensor or np.ndarray): The clip lengths in samples.
+
+        Output: lengths
+            lengths (torch.Tensor or np.ndarray): The clip lengths in feature frames.
+        '''
+        return 1 + lengths // self.hop_length
+
+    def __call__(self, audio):
+        '''Method for computing the features of a batch of audio
+
+        Input: audio
+            audio (torch.Tensor): The audio of shape (batch, channels, frames).
+
+        Output: features
+            features (torch.Tensor): The features of shape (batch, channels, bins, frames).
+        '''
+        batch_shape = audio.shape[:-1]
+        audio = audio.reshape(-1, audio.shape[-1]).float()
+        if self.config['type'] == 'cqt':
+            features = self.cqt(audio)
+        else:
+            spectrum = torch.stft(audio, self.n_fft, hop_length=self.hop_length,
+                                  window=self.window, center=True, pad_mode='constant',
+                                  return_complex=True)
+            features = spectrum.abs() ** self.config['power']
+            if self.config['type'] == 'mel':
+                features = torch.matmul(self.filterbank, features)
+        if self.config['log']:
+            features = torch.log(features + 1e-6)
+        return features.reshape(*batch_shape, *features.shape[-2:])
@@ -0,0 +1,164 @@
+'''
+This module stores the parsed metadata index of the Philharmonia samples. The metadata encoded in
+the sample names is parsed once, stored with categorical integer codes in a companion file next to
+the audio file and memory mapped on every later load so that startup does not grow with the size
+of the sample library.
+'''
+
+# dependencies
+import json
+import os
+import random
+import numpy as np
+
+# user defined modules
+from AtomicFile import replace_file
+
+'''
+Information from the key names separated by the '_' delimiter:.
+Index 0: instrument (banjo, bass-clarinet, bassoon, ..., violin).
+Index 1: midi note (22, 23,24, ..., 108).
+Index 2: duration (025, 05, 1, ..., very long).
+Index 3: dynamics (pianissimo, piano, mezzo-piano, ... fortissimo).
+Index 4: style (normal, fluttertonguing, nonlegato, ..., glissando).
+'''
+PHIL_FIELDS = {'instrument': 0, 'midi': 1, 'duration': 2, 'dynamic': 3, 'style': 4}
+# the fields stored as codes into a list of category names
+CATEGORICAL_FIELDS = ('instrument', 'duration', 'dynamic', 'style')
+# one record per sample, row is the position of the sample in the audio store and length is the
+# number of frames of the sample
+PHIL_INDEX_DTYPE = np.dtype([('row', '<i8'), ('length', '<i8'), ('instrument', '<i2'),
+                             ('midi', '<i2'), ('duration', '<i2'), ('dynamic', '<i2'),
+                             ('style', '<i2')])
+# bumped whenever PHIL_INDEX_DTYPE changes so that older index files are rebuilt
+PHIL_INDEX_VERSION = 2
+
+
+def note_to_midi(note):
+    '''Method for converting Philharmonia note names to midi notes
+
+    Input: note
+        note (string): Note name to convert to midi, for example 'Cs4'.
+
+    Output: midi
+        midi (int): The midi note or -1 if the note name can not be parsed.
+    '''
+    note_names = 'C Cs D Ds E F Fs G Gs A As B'.split(' ')
+    try:
+        return note_names.index(note[:-1]) + (int(note[-1]) + 1) * 12
+    except (ValueError, IndexError):
+        return -1
+
+
+def build_phil_index(names, lengths):
+    '''Method for parsing the metadata of every sample from its name. The records are stored in
+    the order of the sorted names shuffled with a fixed seed so as to not bias the input data.
+
+    Input: names, lengths
+        names (list): The sample names in the order of the audio store.
+        lengths (np.ndarray): The number of frames of every sample in the same order.
+
+    Output: index, categories
+        index (np.ndarray): One PHIL_INDEX_DTYPE record per sample.
+        categories (dict): The category names of every categorical field.
+    '''
+    order = sorted(range(len(names)), key=names.__getitem__)
+    random.Random(4).shuffle(order)
+    information = [names[row].split('_') for row in order]
+    index = np.zeros(len(order), dtype=PHIL_INDEX_DTYPE)
+    index['row'] = order
+    index['length'] = np.asarray(lengths)[order] if order else 0
+    index['midi'] = [note_to_midi(info[PHIL_FIELDS['midi']])
+                     if len(info) > PHIL_FIELDS['midi'] else -1 for info in information]
+    categories = {}
+    for field in CATEGORICAL_FIELDS:
+        column = PHIL_FIELDS[field]
+        values = [info[column] if len(info) > column else '' for info in information]
+        names_, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+        categories[field] = names_.tolist()
+        index[field] = codes.reshape(-1)
+    return index, categories
+
+
+def load_phil_index(file_path, store):
+    '''Method for loading the metadata index stored next to the audio file at file_path. The index
+    is rebuilt and saved whenever it is missing or older than the audio file.
+
+    Input: file_path, store
+        file_path (string): The location of the Philharmonia audio file.
+        store (KeyedStore, PackedStore or MemmapStore): The audio store opened from file_path.
+
+    Output: index, categories
+        index (np.ndarray): The memory mapped PHIL_INDEX_DTYPE records.
+        categories (dict): The category names of every categorical field.
+    '''
+    stat = os.stat(file_path)
+    stamp = [PHIL_INDEX_VERSION, stat.st_size, stat.st_mtime_ns, len(store.names)]
+    try:
+        with open(file_path + '.meta.json') as meta_file:
+            meta = json.load(meta_file)
+        if meta['stamp'] == stamp:
+            return np.load(file_path + '.meta.npy', mmap_mode='r'), meta['categories']
+    except (OSError, ValueError, KeyError):
+        pass
+    index, categories = build_phil_index(store.names, store.lengths)
+    try:
+        # the records are written before the stamp so that an interrupted save is rebuilt, and
+        # both are replaced instead of overwritten since other processes may have them mapped
+        with replace_file(file_path + '.meta.npy', 'wb') as index_file:
+            np.save(index_file, index)
+        with replace_file(file_path + '.meta.json') as meta_file:
+            json.dump({'stamp': stamp, 'categories': categories}, meta_file)
+    except OSError:
+        # a read only data directory only costs the parse on every load
+        pass
+    return index, categories
+
+
+def category_mask(index, categories, field, condition):
+    '''Method for selecting the samples whose category satisfies a condition. The condition is
+    evaluated once per category name and then broadcast over the codes of every sample.
+
+    Input: index, categories, field, condition
+        index (np.ndarray): The PHIL_INDEX_DTYPE records.
+        categories (dict): The category names of every categorical field.
+        field (string): One of CATEGORICAL_FIELDS.
+        condition (callable): Predicate taking a category name.
+
+    Output: mask
+        mask (np.ndarray): Boolean mask over the records.
+    '''
+    matches = np.array([bool(condition(name)) for name in categories[field]], dtype=bool)
+    return matches[index[field]] if len(matches) else np.zeros(len(index), dtype=bool)
+
+
+def select_mask(index, categories, instrument=None, duration=None, dynamic=None, style=None,
+                pitch_range=None):
+    '''Method for selecting the samples matching a query. A categorical condition may be a
+    category name, a collection of category names or a predicate taking a category name, and
+    conditions left as None are not applied.
+
+    Input: index, categories, instrument, duration, dynamic, style, pitch_range
+        index (np.ndarray): The PHIL_INDEX_DTYPE records.
+        categories (dict): The category names of every categorical field.
+        instrument, duration, dynamic, style (string, collection or callable): The conditions
+            on the categorical fields.
+        pitch_range (tuple): The lowest and highest midi note to include.
+
+    Output: mask
+        mask (np.ndarray): Boolean mask over the records.
+    '''
+    mask = np.ones(len(index), dtype=bool)
+    query = {'instrument': instrument, 'duration': duration, 'dynamic': dynamic, 'style': style}
+    for field, condition in query.items():
+        if condition is None:
+            continue
+        if isinstance(condition, str):
+            condition = condition.__eq__
+        elif not callable(condition):
+            condition = frozenset(condition).__contains__
+        mask &= category_mask(index, categories, field, condition)
+    if pitch_range is not None:
+        low, high = pitch_range
+        mask &= (index['midi'] >= low) & (index['midi'] <= high)
+    return mask
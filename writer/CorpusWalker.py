@@ -0,0 +1,199 @@
+'''
+This module is responsible for finding the source files of the writers. The corpus directory is
+walked with os.scandir, which reads the file type of every entry together with its name, and the
+matching files are yielded as soon as their directory has been read so that the writers can start
+decoding long before a large tree has been walked. Wide trees can be walked by several threads and
+the listing can be cached next to the output so that an unchanged tree is never walked again.
+'''
+
+import fnmatch
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+# the loader modules are shared with the data loaders
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loader'))
+from AtomicFile import replace_file
+
+
+def scan_directory(directory):
+    '''Method for reading the entries of a single directory
+
+    Args: directory
+        directory (string): The location of the directory.
+
+    Output: directory, mtime_ns, subdirectories, files
+        directory (string): The location of the directory.
+        mtime_ns (int): The modification time of the directory, which changes whenever one of its
+                        entries is added, removed or renamed.
+        subdirectories (list): The sorted locations of the directories inside of it.
+        files (list): The sorted locations of the files inside of it.
+    '''
+    subdirectories, files = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            else:
+                files.append(entry.path)
+    return directory, os.stat(directory).st_mtime_ns, sorted(subdirectories), sorted(files)
+
+
+def scan_tree(root, num_workers=0):
+    '''Method for reading every directory below root. A single walk reads the directories depth
+    first in sorted order, so the files come out in the same order on every run. Several walkers
+    read the directories concurrently and yield them in the order they finish.
+
+    Args: root, num_workers
+        root (string): The location of the corpus directory.
+        num_workers (int): The number of threads reading directories, 0 walks in this thread.
+                           Default is 0.
+
+    Output: scans (generator)
+        scans (tuple): The scan_directory output of every directory.
+    '''
+    if not num_workers:
+        directories = [root]
+        while directories:
+            scan = scan_directory(directories.pop())
+            # pushed in reverse so that the first subdirectory is walked next
+            directories.extend(reversed(scan[2]))
+            yield scan
+        return
+    # os.scandir releases the GIL, so threads overlap the round trips of network file systems
+    with ThreadPoolExecutor(num_workers) as pool:
+        running = {pool.submit(scan_directory, root)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                scan = future.result()
+                running.update(pool.submit(scan_directory, directory) for directory in scan[2])
+                yield scan
+
+
+def match_file(path, extensions=None, patterns=None):
+    '''Method for checking whether a file passes the extension and glob filters
+
+    Args: path, extensions, patterns
+        path (string): The location of the file relative to the corpus directory.
+        extensions (tuple): The lower case extensions to keep, for example ('.wav',). Default is
+                            every extension.
+        patterns (list): The glob patterns of which the relative path has to match one, for
+                         example ['Clarinet/*']. Default is every path.
+
+    Output: match
+        match (bool): Whether the file is kept.
+    '''
+    if extensions and not path.lower().endswith(extensions):
+        return False
+    return not patterns or any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def load_listing(cache_file, root, extensions, patterns):
+    '''Method for loading a cached listing of a corpus, as long as it was made with the same
+    filters and none of the listed directories has changed since
+
+    Args: cache_file, root, extensions, patterns
+        cache_file (string): The location of the cached listing.
+        root (string): The location of the corpus directory.
+        extensions (tuple): The extension filter of the listing.
+        patterns (list): The glob filter of the listing.
+
+    Output: files, skipped
+        files (list): The listed files or None when the listing is missing or out of date.
+        skipped (int): The number of files skipped by the extension filter.
+    '''
+    try:
+        with open(cache_file) as listing_file:
+            listing = json.load(listing_file)
+        if listing['filters'] != [list(extensions or []), list(patterns or [])]:
+            return None, 0
+        # only the directories have to be checked, their mtime covers every added or deleted entry
+        for directory, mtime_ns in listing['directories'].items():
+            if os.stat(os.path.join(root, directory)).st_mtime_ns != mtime_ns:
+                return None, 0
+    except (OSError, ValueError, KeyError):
+        return None, 0
+    return [os.path.join(root, path) for path in listing['files']], listing.get('skipped', 0)
+
+
+def save_listing(cache_file, extensions, patterns, directories, files, skipped):
+    '''Method for caching the listing of a corpus
+
+    Args: cache_file, extensions, patterns, directories, files, skipped
+        cache_file (string): The location of the cached listing.
+        extensions (tuple): The extension filter of the listing.
+        patterns (list): The glob filter of the listing.
+        directories (dict): The mtime_ns of every directory relative to the corpus directory.
+        files (list): The listed files relative to the corpus directory.
+        skipped (int): The number of files skipped by the extension filter.
+    '''
+    listing = {'filters': [list(extensions or []), list(patterns or [])],
+               'directories': directories,
+               'files': files,
+               'skipped': skipped}
+    try:
+        with replace_file(cache_file) as listing_file:
+            json.dump(listing, listing_file)
+    except OSError:
+        # a read only output directory only costs the walk on every run
+        pass
+
+
+def walk_corpus(root, extensions=None, patterns=None, num_workers=0, cache_file=None):
+    '''Method for lazily finding the files of a corpus. The files of every directory are yielded
+    as soon as it has been read. With a cache_file the listing of a completed walk is saved and
+    later walks of an unchanged tree only stat its directories. The number of files with other
+    extensions is printed once the walk is complete, so that missing extensions are noticed.
+
+    Args: root, extensions, patterns, num_workers, cache_file
+        root (string): The location of the corpus directory.
+        extensions (iterable): The extensions of the files to keep, for example ['.wav'], matched
+                               without regard to case. Default is every extension.
+        patterns (list): Glob patterns matched against the path relative to root, a file is kept
+                         when it matches any of them. Default is every path.
+        num_workers (int): The number of threads reading directories, 0 walks in sorted order in
+                           this thread. Default is 0.
+        cache_file (string): The location of the cached listing. Default is None for no cache.
+
+    Output: files (generator)
+        files (string): The location of every kept file.
+    '''
+    extensions = tuple(sorted(extension.lower() for extension in extensions or ()))
+    patterns = list(patterns or [])
+    if cache_file:
+        files, skipped = load_listing(cache_file, root, extensions, patterns)
+        if files is not None:
+            yield from files
+            report_skipped(root, extensions, skipped)
+            return
+    directories, found, skipped = {}, [], 0
+    for directory, mtime_ns, _, files in scan_tree(root, num_workers):
+        directories[os.path.relpath(directory, root)] = mtime_ns
+        for file in files:
+            path = os.path.relpath(file, root)
+            if match_file(path, extensions, patterns):
+                found.append(path)
+                yield file
+            elif extensions and not path.lower().endswith(extensions):
+                skipped += 1
+    report_skipped(root, extensions, skipped)
+    if cache_file:
+        save_listing(cache_file, extensions, patterns, directories, found, skipped)
+
+
+def report_skipped(root, extensions, skipped):
+    '''Method for printing how many files of a corpus the extension filter skipped
+
+    Args: root, extensions, skipped
+        root (string): The location of the corpus directory.
+        extensions (tuple): The extension filter of the walk.
+        skipped (int): The number of skipped files.
+    '''
+    if skipped:
+        print('{} files in {} skipped, they do not have one of the extensions {}'.format(
+            skipped, root, ', '.join(extensions)))
+
@@ -7,52 +7,1251 @@ and single note recordings.
 '''
 
 import argparse
+import hashlib
+import json
 import os
+import sys
+import time
+import wave
+from collections import deque
+from functools import partial
+from itertools import chain
+from math import gcd
+import numpy as np
 import h5py
+from CorpusWalker import walk_corpus
+from WorkerPool import ordered_map
 
+# the loader modules are shared with the data loaders
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loader'))
+from AudioStore import rate_path
+from AudioStore import open_store
+from AudioStore import decode_names
+from AudioStore import MANIFEST_GROUP
+from AtomicFile import replace_file
+from DataParameters import PARAMETERS as params
 
-def audio_writer(in_path, out_path='.', out_file='out.h5'):
+# the storage dtypes of the audio and the scale that turns their values back into the normalized
+# float audio, 16 bit sources are stored without loss as int16
+STORAGE_SCALES = {'float32': 1.0, 'float16': 1.0, 'int16': 1.0 / 32768}
+# the window of the polyphase resampler, a kaiser window with beta 8.6 gives about 90 dB of
+# stopband attenuation
+RESAMPLE_WINDOW = ('kaiser', 8.6)
+# the extensions of the sound files read by default
+AUDIO_EXTENSIONS = ('.wav',)
+# the compression filters of the .h5 layouts, blosc and lz4 need the hdf5plugin package
+COMPRESSIONS = ('gzip', 'lzf', 'blosc', 'lz4')
+
+
+def filter_options(compression=None, compression_level=None, shuffle=False):
+    '''Method for building the h5py dataset filter options of a compression filter
+
+    Args: compression, compression_level, shuffle
+        compression (string): One of COMPRESSIONS or None for uncompressed audio.
+        compression_level (int): The gzip or blosc compression level. Default is the filter's.
+        shuffle (bool): Whether to shuffle the bytes of every chunk before compressing it.
+
+    Output: options
+        options (dict): The filter keyword arguments of create_dataset.
+    '''
+    if compression is None or compression in ('gzip', 'lzf'):
+        options = {'compression': compression, 'shuffle': shuffle}
+        if compression == 'gzip' and compression_level is not None:
+            options['compression_opts'] = compression_level
+        return options
+    if compression not in COMPRESSIONS:
+        raise ValueError('unsupported compression {}, use one of {}'.format(
+            compression, COMPRESSIONS))
+    try:
+        import hdf5plugin
+    except ImportError:
+        raise ValueError('{} compression needs the hdf5plugin package'.format(compression))
+    if compression == 'lz4':
+        return dict(hdf5plugin.LZ4(), shuffle=shuffle)
+    # blosc shuffles inside of the filter, lz4 inside of blosc decodes fastest
+    return dict(hdf5plugin.Blosc(
+        cname='lz4', clevel=5 if compression_level is None else compression_level,
+        shuffle=hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE))
+
+
+def resample(clip, sample_rate, target_rate):
+    '''Method for resampling a clip with a polyphase filter
+
+    Args: clip, sample_rate, target_rate
+        clip (np.ndarray): The audio of shape (channels, frames).
+        sample_rate (int): The sample rate of the clip.
+        target_rate (int): The sample rate to resample to.
+
+    Output: clip
+        clip (np.ndarray): The resampled audio in the dtype of the input.
+    '''
+    if sample_rate == target_rate:
+        return clip
+    from scipy.signal import resample_poly
+    divisor = gcd(sample_rate, target_rate)
+    return resample_poly(clip, target_rate // divisor, sample_rate // divisor, axis=-1,
+                         window=RESAMPLE_WINDOW).astype(clip.dtype)
+
+
+class BlockResampler:
+    '''Polyphase resampler for audio that arrives in blocks. Every block is resampled together with
+    enough of the frames around it to cover the filter, so that every output frame is computed from
+    the same input frames and filter taps as when the whole clip is resampled at once and the
+    concatenated output is identical to that of resample. The output therefore lags the input by
+    the filter context.
+
+    Args: sample_rate, target_rate
+        sample_rate (int): The sample rate of the input blocks.
+        target_rate (int): The sample rate to resample to.
+    '''
+    def __init__(self, sample_rate, target_rate):
+        divisor = gcd(sample_rate, target_rate)
+        self.up, self.down = target_rate // divisor, sample_rate // divisor
+        # the half length of the resample_poly filter in input frames, rounded up to whole steps
+        # of down frames so that every resampled span starts on an output frame
+        half_length = 10 * max(self.up, self.down) // self.up + 1
+        self.context = -(-half_length // self.down) * self.down
+        self.buffer = None
+        # the input frame of the first buffered frame and the input frames already resampled
+        self.position, self.done = 0, 0
+
+    def push(self, block, final=False):
+        '''Method for resampling the next block
+
+        Args: block, final
+            block (np.ndarray): The next input frames of shape (channels, frames).
+            final (bool): Whether this is the last block of the clip. Default is False.
+
+        Output: block
+            block (np.ndarray): The output frames that are complete with this block.
+        '''
+        if self.up == self.down:
+            return block
+        self.buffer = block if self.buffer is None else np.concatenate([self.buffer, block], -1)
+        end = self.position + self.buffer.shape[-1]
+        if final:
+            stop = end
+        else:
+            stop = self.done + max(end - self.context - self.done, 0) // self.down * self.down
+        if stop <= self.done:
+            return self.buffer[..., :0]
+        from scipy.signal import resample_poly
+        span_start = max(self.done - self.context, 0)
+        span = self.buffer[..., span_start - self.position:min(stop + self.context, end)
+                           - self.position]
+        resampled = resample_poly(span, self.up, self.down, axis=-1, window=RESAMPLE_WINDOW)
+        lead = (self.done - span_start) * self.up // self.down
+        length = -(-(stop - self.done) * self.up // self.down)
+        self.done = stop
+        # only the context of the next span is kept
+        keep = max(self.done - self.context, 0)
+        self.buffer = self.buffer[..., keep - self.position:]
+        self.position = keep
+        return resampled[..., lead:lead + length].astype(block.dtype)
+
+
+def clip_name(file):
+    '''Method for naming the clip of a sound file
+
+    Args: file
+        file (string): The location of the sound file.
+
+    Output: name
+        name (string): The file name without its directory and extension.
+    '''
+    return os.path.splitext(os.path.basename(file))[0]
+
+
+def file_hash(file):
+    '''Method for hashing the content of a source file
+
+    Args: file
+        file (string): The location of the file.
+
+    Output: digest
+        digest (string): The sha1 hex digest of the file.
+    '''
+    digest = hashlib.sha1()
+    with open(file, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_entry(file, known=None, hash_sources=False):
+    '''Method for building the manifest entry of a source file. The hash of a source whose size
+    and mtime match its known entry is taken from that entry instead of reading the file.
+
+    Args: file, known, hash_sources
+        file (string): The location of the source file.
+        known (dict): The manifest entry the source was last written with. Default is None.
+        hash_sources (bool): Whether to hash the content of the source. Default is False.
+
+    Output: entry
+        entry (dict): The clip name, size, mtime_ns and hash of the source, the hash is empty
+                      when hash_sources is not set.
+    '''
+    stat = os.stat(file)
+    entry = {'name': clip_name(file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+             'hash': ''}
+    if hash_sources:
+        if known and known['hash'] and same_source(known, entry):
+            entry['hash'] = known['hash']
+        else:
+            entry['hash'] = file_hash(file)
+    return entry
+
+
+def same_source(known, entry):
+    '''Method for checking whether a source is unchanged since it was written. Sources with a
+    hash on both sides are compared by their hash, which survives copies that touch the mtime.
+
+    Args: known, entry
+        known (dict): The manifest entry the source was written with, None for new sources.
+        entry (dict): The current manifest entry of the source.
+
+    Output: same
+        same (bool): Whether the clip of the source is up to date.
+    '''
+    if known is None:
+        return False
+    if known['hash'] and entry['hash']:
+        return known['hash'] == entry['hash']
+    return known['size'] == entry['size'] and known['mtime_ns'] == entry['mtime_ns']
+
+
+def read_manifest(frame):
+    '''Method for reading the source manifest stored in a .h5 output file
+
+    Args: frame
+        frame (h5py.File): The output file.
+
+    Output: manifest
+        manifest (dict): The name, size, mtime_ns and hash of every source path.
+    '''
+    if MANIFEST_GROUP not in frame:
+        return {}
+    group = frame[MANIFEST_GROUP]
+    columns = zip(decode_names(group['path'][:]), decode_names(group['name'][:]),
+                  group['size'][:].tolist(), group['mtime_ns'][:].tolist(),
+                  decode_names(group['hash'][:]))
+    return {path: {'name': name, 'size': size, 'mtime_ns': mtime_ns, 'hash': digest}
+            for path, name, size, mtime_ns, digest in columns}
+
+
+def write_manifest(frame, manifest):
+    '''Method for replacing the source manifest stored in a .h5 output file
+
+    Args: frame, manifest
+        frame (h5py.File): The output file.
+        manifest (dict): The name, size, mtime_ns and hash of every source path.
+    '''
+    if MANIFEST_GROUP in frame:
+        del frame[MANIFEST_GROUP]
+    group = frame.create_group(MANIFEST_GROUP)
+    entries = list(manifest.values())
+    for column in ('name', 'hash'):
+        group.create_dataset(column, data=np.array([entry[column] for entry in entries],
+                                                   dtype=object),
+                             dtype=h5py.special_dtype(vlen=str))
+    group.create_dataset('path', data=np.array(list(manifest), dtype=object),
+                         dtype=h5py.special_dtype(vlen=str))
+    for column in ('size', 'mtime_ns'):
+        group.create_dataset(column, data=np.array([entry[column] for entry in entries],
+                                                   dtype=np.int64))
+
+
+def stored_layout(file_path):
+    '''Method for finding the layout of an existing output
+
+    Args: file_path
+        file_path (string): The location of the output.
+
+    Output: layout
+        layout (string): One of WRITERS or 'sharded', None for a raw output whose index was never
+                         written.
+    '''
+    if h5py.is_hdf5(file_path):
+        with h5py.File(file_path, 'r') as frame:
+            layout = frame.attrs.get('layout', 'keyed')
+        return layout.decode() if isinstance(layout, bytes) else layout
+    if os.path.exists(file_path + '.json'):
+        return 'raw'
+    try:
+        with open(file_path, 'rb') as manifest_file:
+            # only a shard manifest is JSON, the audio of a raw output is never parsed
+            if manifest_file.read(1) != b'{':
+                return None
+            manifest_file.seek(0)
+            return json.load(manifest_file).get('layout')
+    except (OSError, ValueError):
+        return None
+
+
+class AudioWriter:
+    '''Base class of the output layout writers keeping track of the sample rate, the storage dtype,
+    the chunking and compression and the source manifest of the output. The manifest holds the
+    name, size, mtime and optional hash of the source file of every clip, so that a later run in
+    append mode only has to write the clips of new or changed sources.
+
+    Args: file_path, mode, dtype, chunk_frames, compression, compression_level, shuffle
+        file_path (string): The location of the output file.
+        mode (string): 'w' to write a new output or 'a' to update an existing output, which is
+                       created when it is missing. Default is 'w'.
+        dtype (string): The storage dtype of the audio, one of STORAGE_SCALES. Default is 'float32'.
+        chunk_frames (int): The number of frames of every chunk. Default is one sound_duration
+                            window at the sample rate of the output.
+        compression (string): The compression filter, one of COMPRESSIONS. Default is None.
+        compression_level (int): The gzip or blosc compression level. Default is the filter's.
+        shuffle (bool): Whether to shuffle the bytes of every chunk before compressing it.
+                        Default is False.
+    '''
+    # the layout of the outputs of every writer
+    LAYOUT = None
+
+    def __init__(self, file_path, mode='w', dtype='float32', chunk_frames=None, compression=None,
+                 compression_level=None, shuffle=False):
+        if mode not in ('w', 'a'):
+            raise ValueError('unsupported mode {}, use \'w\' or \'a\''.format(mode))
+        if dtype not in STORAGE_SCALES:
+            raise ValueError('unsupported storage dtype {}, use one of {}'.format(
+                dtype, sorted(STORAGE_SCALES)))
+        self.file_path = file_path
+        self.mode = 'a' if mode == 'a' and os.path.exists(file_path) else 'w'
+        layout = stored_layout(file_path) if self.mode == 'a' else None
+        if layout not in (None, self.LAYOUT):
+            raise ValueError('{} is a {} output and can not be updated with the {} layout'.format(
+                file_path, layout, self.LAYOUT))
+        self.sample_rate = None
+        self.dtype = np.dtype(dtype)
+        self.scale = STORAGE_SCALES[dtype]
+        self.chunk_frames = chunk_frames
+        self.filters = filter_options(compression, compression_level, shuffle)
+        self.manifest = {}
+
+    @property
+    def chunked(self):
+        '''Whether the output has to be chunked for the requested chunking and filters'''
+        return bool(self.chunk_frames or self.filters['compression'] or self.filters['shuffle'])
+
+    def window_frames(self):
+        '''Method for computing the number of frames of every chunk
+
+        Output: chunk_frames
+            chunk_frames (int): The chunk_frames option or the frames of one sound_duration window.
+        '''
+        if self.chunk_frames:
+            return self.chunk_frames
+        if self.sample_rate is None:
+            return 1 << 16
+        return max(int(params['sound_duration'] * self.sample_rate), 1)
+
+    def encode(self, clip):
+        '''Method for converting a normalized float clip to the storage dtype
+
+        Args: clip
+            clip (np.ndarray): The audio of shape (channels, frames).
+
+        Output: clip
+            clip (np.ndarray): The audio in the storage dtype, multiplied by scale on reading.
+        '''
+        if self.dtype.kind == 'i':
+            info = np.iinfo(self.dtype)
+            return np.clip(np.rint(clip / self.scale), info.min, info.max).astype(self.dtype)
+        return clip.astype(self.dtype, copy=False)
+
+    def check_dtype(self, dtype, scale):
+        '''Method for making sure that an existing output is updated in its own storage dtype
+
+        Args: dtype, scale
+            dtype (np.dtype): The storage dtype of the existing output.
+            scale (float): The scale of the existing output.
+        '''
+        if np.dtype(dtype) != self.dtype or scale != self.scale:
+            raise ValueError('{} is stored as {} and can not be updated with {} audio'.format(
+                self.file_path, np.dtype(dtype), self.dtype))
+
+    def check_rate(self, name, sample_rate):
+        '''Method for making sure that every clip of the output has the same sample rate
+
+        Args: name, sample_rate
+            name (string): The name of the clip.
+            sample_rate (int): The sample rate of the clip.
+
+        Output: first
+            first (bool): Whether this is the first clip written.
+        '''
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+            return True
+        if sample_rate != self.sample_rate:
+            raise ValueError('{} has a sample rate of {} but the output has {}, pass target '
+                             'sample rates to resample every clip'.format(
+                                 name, sample_rate, self.sample_rate))
+        return False
+
+    def append(self, name, clip, sample_rate):
+        '''Method for writing a single clip, replacing any clip of the same name
+
+        Args: name, clip, sample_rate
+            name (string): The name of the clip.
+            clip (np.ndarray): The audio of shape (channels, frames).
+            sample_rate (int): The sample rate of the clip.
+        '''
+        self.start_clip(name, sample_rate)
+        self.write_block(clip)
+        self.end_clip()
+
+    def stale(self, sources):
+        '''Method for finding the sources whose clips have to be written
+
+        Args: sources
+            sources (dict): The manifest entry of every current source path.
+
+        Output: paths
+            paths (list): The source paths that are new or changed since they were written.
+        '''
+        return [path for path, entry in sources.items()
+                if not same_source(self.manifest.get(path), entry)]
+
+    def record(self, path, entry):
+        '''Method for adding the source of a written clip to the manifest
+
+        Args: path, entry
+            path (string): The source path relative to the corpus directory.
+            entry (dict): The name, size, mtime_ns and hash of the source.
+        '''
+        self.manifest[path] = entry
+
+    def remove(self, path):
+        '''Method for removing a deleted source and its clip from the output
+
+        Args: path
+            path (string): The source path relative to the corpus directory.
+        '''
+        entry = self.manifest.pop(path)
+        # another source may have written a clip of the same name since
+        if not any(other['name'] == entry['name'] for other in self.manifest.values()):
+            self.drop(entry['name'])
+
+
+class KeyedWriter(AudioWriter):
+    '''Writer for the keyed layout where every clip is stored in its own dataset of shape
+    (channels, frames) named after the clip. HDF5 does not reuse the space of removed clips, run
+    h5repack to reclaim it.
+
+    Args: file_path, options
+        file_path (string): The location of the output .h5 file.
+        options: The options of the AudioWriter. The clips are only chunked when one of
+                 chunk_frames, compression and shuffle is given.
+    '''
+    LAYOUT = 'keyed'
+
+    def __init__(self, file_path, **options):
+        super().__init__(file_path, **options)
+        self.audio_frame = h5py.File(file_path, self.mode)
+        if self.mode == 'a':
+            self.manifest = read_manifest(self.audio_frame)
+            first = next((name for name in self.audio_frame if name != MANIFEST_GROUP), None)
+            self.check_dtype(self.audio_frame[first].dtype if first else self.dtype,
+                             float(self.audio_frame.attrs.get('scale', 1.0)))
+            self.sample_rate = self.audio_frame.attrs.get('sample_rate')
+        self.audio_frame.attrs['scale'] = self.scale
+
+    def append(self, name, clip, sample_rate):
+        '''Method for writing a single clip, replacing any clip of the same name
+
+        Args: name, clip, sample_rate
+            name (string): The name of the clip.
+            clip (np.ndarray): The audio of shape (channels, frames).
+            sample_rate (int): The sample rate of the clip.
+        '''
+        if self.check_rate(name, sample_rate):
+            self.audio_frame.attrs['sample_rate'] = sample_rate
+        clip = self.encode(clip)
+        self.drop(name)
+        if not self.chunked:
+            self.audio_frame.create_dataset(name, data=clip)
+            return
+        chunks = (clip.shape[0], max(min(self.window_frames(), clip.shape[-1]), 1))
+        self.audio_frame.create_dataset(name, data=clip, chunks=chunks, **self.filters)
+
+    def start_clip(self, name, sample_rate):
+        '''Method for starting a clip that is written block by block into a resizable chunked
+        dataset, replacing any clip of the same name
+
+        Args: name, sample_rate
+            name (string): The name of the clip.
+            sample_rate (int): The sample rate of the clip.
+        '''
+        if self.check_rate(name, sample_rate):
+            self.audio_frame.attrs['sample_rate'] = sample_rate
+        self.drop(name)
+        self.current, self.dataset = name, None
+
+    def write_block(self, block):
+        '''Method for appending the next block of the started clip
+
+        Args: block
+            block (np.ndarray): The next frames of shape (channels, frames).
+        '''
+        block = self.encode(block)
+        if self.dataset is None:
+            self.dataset = self.audio_frame.create_dataset(
+                self.current, shape=(block.shape[0], 0), maxshape=(block.shape[0], None),
+                dtype=self.dtype, chunks=(block.shape[0], self.window_frames()), **self.filters)
+        offset = self.dataset.shape[-1]
+        self.dataset.resize(offset + block.shape[-1], axis=1)
+        self.dataset[:, offset:] = block
+
+    def end_clip(self):
+        '''Method for finishing the started clip'''
+        if self.dataset is None:
+            self.write_block(np.zeros((1, 0), dtype=self.dtype))
+        self.current, self.dataset = None, None
+
+    def drop(self, name):
+        '''Method for deleting the clip of a name if it was written
+
+        Args: name
+            name (string): The name of the clip.
+        '''
+        if name in self.audio_frame:
+            del self.audio_frame[name]
+
+    def checkpoint(self):
+        '''Method for writing the manifest and flushing the output file'''
+        write_manifest(self.audio_frame, self.manifest)
+        self.audio_frame.flush()
+
+    def close(self):
+        '''Method for writing the manifest and closing the output file'''
+        write_manifest(self.audio_frame, self.manifest)
+        self.audio_frame.close()
+
+
+class PackedWriter(AudioWriter):
+    '''Writer for the packed layout where every clip is appended to one 'audio' dataset of shape
+    (frames, channels). The (offset, length) of every clip is stored in the 'index' dataset and the
+    clip names are stored in the 'names' dataset in the same order. The scale of the storage dtype
+    is stored in the attributes of the 'audio' dataset, which is always chunked. Updated clips are
+    appended and the frames of replaced or removed clips are left unreferenced until the output is
+    written again in mode 'w'.
+
+    Args: file_path, options
+        file_path (string): The location of the output .h5 file.
+        options: The options of the AudioWriter. An existing output keeps its own chunking and
+                 compression.
+    '''
+    LAYOUT = 'packed'
+
+    def __init__(self, file_path, **options):
+        super().__init__(file_path, **options)
+        self.audio_frame = h5py.File(file_path, self.mode)
+        if self.mode == 'w':
+            self.audio_frame.attrs['layout'] = self.LAYOUT
+        self.audio = None
+        # the (offset, length) of every clip name in the order they were written
+        self.clips = {}
+        if self.mode == 'a':
+            self.manifest = read_manifest(self.audio_frame)
+            self.sample_rate = self.audio_frame.attrs.get('sample_rate')
+            if 'index' in self.audio_frame:
+                names = decode_names(self.audio_frame['names'][:])
+                self.clips = dict(zip(names, self.audio_frame['index'][:].tolist()))
+            if 'audio' in self.audio_frame:
+                self.audio = self.audio_frame['audio']
+                self.check_dtype(self.audio.dtype, float(self.audio.attrs.get('scale', 1.0)))
+                # frames written after the last checkpoint of an interrupted run are dropped
+                end = max([offset + length for offset, length in self.clips.values()], default=0)
+                self.audio.resize(end, axis=0)
+
+    def start_clip(self, name, sample_rate):
+        '''Method for starting a clip that is appended block by block, replacing any clip of the
+        same name once it is finished
+
+        Args: name, sample_rate
+            name (string): The name of the clip.
+            sample_rate (int): The sample rate of the clip.
+        '''
+        if self.check_rate(name, sample_rate):
+            self.audio_frame.attrs['sample_rate'] = sample_rate
+        self.current = [name, self.audio.shape[0] if self.audio is not None else 0, 0]
+
+    def write_block(self, block):
+        '''Method for appending the next block of the started clip
+
+        Args: block
+            block (np.ndarray): The next frames of shape (channels, frames).
+        '''
+        frames = self.encode(block).T
+        if self.audio is None:
+            self.create_audio(frames.shape[1])
+        elif frames.shape[1] != self.audio.shape[1]:
+            raise ValueError('{} has {} channels but the packed audio has {}'.format(
+                self.current[0], frames.shape[1], self.audio.shape[1]))
+        offset = self.audio.shape[0]
+        self.audio.resize(offset + frames.shape[0], axis=0)
+        self.audio[offset:] = frames
+        self.current[2] += frames.shape[0]
+
+    def end_clip(self):
+        '''Method for adding the started clip to the index'''
+        name, offset, length = self.current
+        self.drop(name)
+        self.clips[name] = (offset, length)
+        self.current = None
+
+    def drop(self, name):
+        '''Method for removing the clip of a name from the index
+
+        Args: name
+            name (string): The name of the clip.
+        '''
+        self.clips.pop(name, None)
+
+    def create_audio(self, channels):
+        '''Method for creating the resizable 'audio' dataset
+
+        Args: channels
+            channels (int): The number of channels of every frame.
+        '''
+        self.audio = self.audio_frame.create_dataset(
+            'audio', shape=(0, channels), maxshape=(None, channels), dtype=self.dtype,
+            chunks=(self.window_frames(), channels), **self.filters)
+        self.audio.attrs['scale'] = self.scale
+
+    def checkpoint(self):
+        '''Method for writing the clip index and the manifest and flushing the output file'''
+        for dataset in ('index', 'names'):
+            if dataset in self.audio_frame:
+                del self.audio_frame[dataset]
+        self.audio_frame.create_dataset(
+            'index', data=np.array(list(self.clips.values()), dtype=np.int64).reshape(-1, 2))
+        self.audio_frame.create_dataset(
+            'names', data=np.array(list(self.clips), dtype=object),
+            dtype=h5py.special_dtype(vlen=str))
+        write_manifest(self.audio_frame, self.manifest)
+        self.audio_frame.flush()
+
+    def close(self):
+        '''Method for writing the clip index and the manifest and closing the output file'''
+        if self.audio is None:
+            self.create_audio(1)
+        self.checkpoint()
+        self.audio_frame.close()
+
+
+class RawWriter(AudioWriter):
+    '''Writer for the uncompressed raw layout that is memory mapped by the loaders. The frames of
+    every clip are appended to a flat (frames, channels) file and a JSON index holding the dtype,
+    the channel count, the scale of the dtype, the name, offset and length of every clip and the
+    manifest is written to file_path + '.json'. Updated clips are appended and the frames of
+    replaced or removed clips are left unreferenced until the output is written again in mode 'w'.
+
+    Args: file_path, options
+        file_path (string): The location of the output raw file.
+        options: The options of the AudioWriter, the raw layout can not be compressed.
+    '''
+    LAYOUT = 'raw'
+
+    def __init__(self, file_path, **options):
+        super().__init__(file_path, **options)
+        if self.chunked:
+            raise ValueError('the raw layout is memory mapped and can not be chunked or compressed')
+        if self.mode == 'a' and not os.path.exists(file_path + '.json'):
+            self.mode = 'w'
+        self.channels = None
+        # the (offset, length) of every clip name in the order they were written
+        self.clips = {}
+        self.num_frames = 0
+        if self.mode == 'a':
+            with open(file_path + '.json') as index_file:
+                index = json.load(index_file)
+            self.check_dtype(index['dtype'], index.get('scale', 1.0))
+            self.channels = index['channels'] if index['names'] else None
+            self.sample_rate = index.get('sample_rate')
+            self.clips = {name: (offset, length) for name, offset, length
+                          in zip(index['names'], index['offsets'], index['lengths'])}
+            self.manifest = index.get('manifest', {})
+            # frames written after the last checkpoint of an interrupted run are dropped
+            self.num_frames = max([offset + length for offset, length in self.clips.values()],
+                                  default=0)
+            self.audio_file = open(file_path, 'r+b')
+            self.audio_file.truncate(self.num_frames * (self.channels or 1) * self.dtype.itemsize)
+            self.audio_file.seek(0, os.SEEK_END)
+        else:
+            self.audio_file = open(file_path, 'wb')
+
+    def start_clip(self, name, sample_rate):
+        '''Method for starting a clip that is appended block by block, replacing any clip of the
+        same name once it is finished
+
+        Args: name, sample_rate
+            name (string): The name of the clip.
+            sample_rate (int): The sample rate of the clip.
+        '''
+        self.check_rate(name, sample_rate)
+        self.current = [name, self.num_frames, 0]
+
+    def write_block(self, block):
+        '''Method for appending the next block of the started clip
+
+        Args: block
+            block (np.ndarray): The next frames of shape (channels, frames).
+        '''
+        frames = self.encode(block).T
+        if self.channels is None:
+            self.channels = frames.shape[1]
+        elif frames.shape[1] != self.channels:
+            raise ValueError('{} has {} channels but the raw audio has {}'.format(
+                self.current[0], frames.shape[1], self.channels))
+        np.ascontiguousarray(frames, dtype=self.dtype).tofile(self.audio_file)
+        self.current[2] += frames.shape[0]
+        self.num_frames += frames.shape[0]
+
+    def end_clip(self):
+        '''Method for adding the started clip to the index'''
+        name, offset, length = self.current
+        self.drop(name)
+        self.clips[name] = (offset, length)
+        self.current = None
+
+    def drop(self, name):
+        '''Method for removing the clip of a name from the index
+
+        Args: name
+            name (string): The name of the clip.
+        '''
+        self.clips.pop(name, None)
+
+    def checkpoint(self):
+        '''Method for flushing the output file and replacing its JSON index'''
+        self.audio_file.flush()
+        index = {'layout': 'raw',
+                 'dtype': self.dtype.str,
+                 'scale': self.scale,
+                 'channels': self.channels or 1,
+                 'sample_rate': self.sample_rate,
+                 'names': list(self.clips),
+                 'offsets': [offset for offset, _ in self.clips.values()],
+                 'lengths': [length for _, length in self.clips.values()],
+                 'manifest': self.manifest}
+        # written next to the index and moved over it so that an interruption keeps the old one
+        with replace_file(self.file_path + '.json') as index_file:
+            json.dump(index, index_file)
+
+    def close(self):
+        '''Method for closing the output file and writing its JSON index'''
+        self.checkpoint()
+        self.audio_file.close()
+
+
+# the writers for every supported output layout
+WRITERS = {'keyed': KeyedWriter, 'packed': PackedWriter, 'raw': RawWriter}
+
+
+def shard_path(file_path, shard):
+    '''Method for naming a shard of a sharded output
+
+    Args: file_path, shard
+        file_path (string): The location of the shard manifest, for example 'Phil.h5'.
+        shard (int): The position of the shard.
+
+    Output: file_path
+        file_path (string): The location of the shard, for example 'Phil-00003.h5'.
+    '''
+    root, extension = os.path.splitext(file_path)
+    return '{}-{:05d}{}'.format(root, shard, extension)
+
+
+class ShardedWriter(AudioWriter):
+    '''Writer splitting the output into shards of another layout. A new shard is started once the
+    current one holds max_clips clips or max_bytes bytes of uncompressed audio, and the JSON
+    shard manifest written to file_path lists the names and lengths of the clips of every shard
+    together with the source manifest. The loaders open the manifest as an AudioStore.ShardedStore,
+    and every shard is a complete output of its layout that can be copied or rebuilt on its own.
+
+    Args: file_path, layout, max_bytes, max_clips, options
+        file_path (string): The location of the shard manifest, the shards are written next to it.
+        layout (string): The layout of the shards, one of WRITERS. Default is 'packed'.
+        max_bytes (int): The uncompressed audio bytes of every shard. Default is no limit.
+        max_clips (int): The number of clips of every shard. Default is no limit.
+        options: The options of the AudioWriter, passed on to the shards.
+    '''
+    LAYOUT = 'sharded'
+
+    def __init__(self, file_path, layout='packed', max_bytes=None, max_clips=None, **options):
+        super().__init__(file_path, **options)
+        self.layout = layout
+        self.max_bytes = max_bytes
+        self.max_clips = max_clips
+        self.options = {key: value for key, value in options.items() if key != 'mode'}
+        self.channels = None
+        # the clip lengths and written frames of every shard and the shard of every clip name
+        self.shards, self.shard_of = [], {}
+        # the open shard writers and the shards that already exist on disk
+        self.writers, self.existing = {}, set()
+        self.current = None
+        if self.mode == 'a':
+            with open(file_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('shard_layout') != layout:
+                raise ValueError('{} holds {} shards and can not be updated with {} shards'.format(
+                    file_path, manifest.get('shard_layout'), layout))
+            self.check_dtype(manifest['dtype'], manifest.get('scale', 1.0))
+            self.sample_rate = manifest.get('sample_rate')
+            self.manifest = manifest.get('sources', {})
+            for shard, entry in enumerate(manifest['shards']):
+                clips = dict(zip(entry['names'], entry['lengths']))
+                self.shards.append({'clips': clips, 'frames': sum(clips.values())})
+                self.shard_of.update((name, shard) for name in clips)
+            self.channels = manifest['channels'] if self.shard_of else None
+            self.existing.update(range(len(self.shards)))
+
+    def shard_writer(self, shard):
+        '''Method for retrieving the writer of a shard, opening it on first use
+
+        Args: shard
+            shard (int): The position of the shard.
+
+        Output: writer
+            writer (AudioWriter): The writer of the shard.
+        '''
+        if shard not in self.writers:
+            mode = 'a' if shard in self.existing else 'w'
+            self.writers[shard] = WRITERS[self.layout](shard_path(self.file_path, shard),
+                                                       mode=mode, **self.options)
+            self.existing.add(shard)
+        return self.writers[shard]
+
+    def full(self):
+        '''Method for checking whether the current shard has reached one of its limits
+
+        Output: full
+            full (bool): Whether the next clip starts a new shard.
+        '''
+        shard = self.shards[-1]
+        frame_bytes = (self.channels or 1) * self.dtype.itemsize
+        return bool((self.max_clips and len(shard['clips']) >= self.max_clips)
+                    or (self.max_bytes and shard['frames'] * frame_bytes >= self.max_bytes))
+
+    def start_clip(self, name, sample_rate):
+        '''Method for starting a clip in the current shard, or in a new one when it is full
+
+        Args: name, sample_rate
+            name (string): The name of the clip.
+            sample_rate (int): The sample rate of the clip.
+        '''
+        self.check_rate(name, sample_rate)
+        if not self.shards or self.full():
+            # a finished shard is closed so that only the current shard is held open
+            if self.shards and len(self.shards) - 1 in self.writers:
+                self.writers.pop(len(self.shards) - 1).close()
+            self.shards.append({'clips': {}, 'frames': 0})
+        self.shard_writer(len(self.shards) - 1).start_clip(name, sample_rate)
+        self.current = [name, 0]
+
+    def write_block(self, block):
+        '''Method for appending the next block of the started clip
+
+        Args: block
+            block (np.ndarray): The next frames of shape (channels, frames).
+        '''
+        if self.channels is None:
+            self.channels = block.shape[0]
+        self.shard_writer(len(self.shards) - 1).write_block(block)
+        self.current[1] += block.shape[-1]
+
+    def end_clip(self):
+        '''Method for adding the started clip to the current shard'''
+        shard = len(self.shards) - 1
+        self.shard_writer(shard).end_clip()
+        name, length = self.current
+        if self.shard_of.get(name, shard) != shard:
+            self.drop(name)
+        elif name in self.shards[shard]['clips']:
+            # a clip replaced in the current shard was already replaced by its writer
+            self.shards[shard]['frames'] -= self.shards[shard]['clips'][name]
+        self.shards[shard]['clips'][name] = length
+        self.shards[shard]['frames'] += length
+        self.shard_of[name] = shard
+        self.current = None
+
+    def drop(self, name):
+        '''Method for removing the clip of a name from its shard
+
+        Args: name
+            name (string): The name of the clip.
+        '''
+        shard = self.shard_of.pop(name, None)
+        if shard is None:
+            return
+        self.shards[shard]['frames'] -= self.shards[shard]['clips'].pop(name)
+        opened = shard not in self.writers
+        self.shard_writer(shard).drop(name)
+        # a finished shard is closed again so that only the current shard is held open
+        if opened and shard != len(self.shards) - 1:
+            self.writers.pop(shard).close()
+
+    def write_shard_manifest(self):
+        '''Method for replacing the JSON shard manifest'''
+        manifest = {'layout': 'sharded',
+                    'shard_layout': self.layout,
+                    'dtype': self.dtype.str,
+                    'scale': self.scale,
+                    'channels': self.channels or 1,
+                    'sample_rate': self.sample_rate,
+                    'shards': [{'file': os.path.basename(shard_path(self.file_path, shard)),
+                                'names': list(entry['clips']),
+                                'lengths': list(entry['clips'].values())}
+                               for shard, entry in enumerate(self.shards)],
+                    'sources': self.manifest}
+        # written next to the manifest and moved over it so that an interruption keeps the old one
+        with replace_file(self.file_path) as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    def checkpoint(self):
+        '''Method for checkpointing the open shards and replacing the shard manifest'''
+        for writer in self.writers.values():
+            writer.checkpoint()
+        self.write_shard_manifest()
+
+    def close(self):
+        '''Method for closing the open shards and writing the shard manifest'''
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        self.write_shard_manifest()
+
+
+def decode_file(file, sample_rates):
+    '''Method for decoding a sound file and resampling it to every target sample rate, run by the
+    decoding processes of the audio_writer
+
+    Args: file, sample_rates
+        file (string): The location of the sound file.
+        sample_rates (list): The target sample rates, None keeps the rate of the file.
+
+    Output: file_name, clips
+        file_name (string): The name of the clip, the file name without its extension.
+        clips (list): The (clip, sample_rate) of every target sample rate.
+    '''
+    import torchaudio
+    clip, sample_rate = torchaudio.load(filepath=file,
+                                        out=None,
+                                        normalization=True,
+                                        channels_first=True,
+                                        num_frames=0,
+                                        offset=0,
+                                        signalinfo=None,
+                                        encodinginfo=None,
+                                        filetype=None)
+    clip = clip.numpy()
+    return clip_name(file), [(resample(clip, sample_rate, rate or sample_rate), rate or sample_rate)
+                       for rate in sample_rates]
+
+
+def pcm_frames(data, width, channels):
+    '''Method for converting the little endian PCM frames of a wave file to float, scaled like
+    the normalized output of torchaudio.load
+
+    Args: data, width, channels
+        data (bytes): The PCM frames.
+        width (int): The bytes of every sample, 1 for unsigned and 2 to 4 for signed samples.
+        channels (int): The number of channels.
+
+    Output: block
+        block (np.ndarray): The frames of shape (channels, frames) in [-1, 1).
+    '''
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 3:
+        # 24 bit samples are moved into the upper bytes of int32 samples
+        padded = np.zeros((len(data) // 3, 4), dtype=np.uint8)
+        padded[:, 1:] = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = padded.view('<i4').reshape(-1).astype(np.float32) / 2.0 ** 31
+    else:
+        samples = (np.frombuffer(data, dtype='<i{}'.format(width)).astype(np.float32)
+                   / 2.0 ** (8 * width - 1))
+    return np.ascontiguousarray(samples.reshape(-1, channels).T)
+
+
+def read_blocks(file, block_frames):
+    '''Method for decoding a sound file block by block so that only one block is held in memory.
+    PCM wave files are read sequentially from a single open file, other files are decoded by
+    torchaudio one block at a time up to the frame count of the file.
+
+    Args: file, block_frames
+        file (string): The location of the sound file.
+        block_frames (int): The number of frames of every block.
+
+    Output: blocks (generator)
+        block (np.ndarray): The next frames of shape (channels, frames), a single empty block for
+                            an empty file.
+        sample_rate (int): The sample rate of the file.
+    '''
+    if file.lower().endswith('.wav'):
+        try:
+            wav = wave.open(file, 'rb')
+        except (wave.Error, EOFError):
+            # float wave files are left to torchaudio
+            wav = None
+        if wav is not None:
+            with wav:
+                channels, width = wav.getnchannels(), wav.getsampwidth()
+                num_frames = wav.getnframes()
+                for offset in range(0, max(num_frames, 1), block_frames):
+                    data = wav.readframes(min(block_frames, num_frames - offset))
+                    yield pcm_frames(data, width, channels), wav.getframerate()
+            return
+    import torchaudio
+    info = torchaudio.info(file)
+    if isinstance(info, tuple):
+        # older releases return the signal info with the samples of all channels
+        num_frames = info[0].length // info[0].channels
+    else:
+        num_frames = info.num_frames
+    for offset in range(0, max(num_frames, 1), block_frames):
+        block, sample_rate = torchaudio.load(filepath=file,
+                                             out=None,
+                                             normalization=True,
+                                             channels_first=True,
+                                             num_frames=min(block_frames, num_frames - offset),
+                                             offset=offset,
+                                             signalinfo=None,
+                                             encodinginfo=None,
+                                             filetype=None)
+        yield block.numpy(), sample_rate
+
+
+def stream_file(file, sample_rates, block_frames):
+    '''Method for decoding a sound file block by block and resampling every block to every target
+    sample rate
+
+    Args: file, sample_rates, block_frames
+        file (string): The location of the sound file.
+        sample_rates (list): The target sample rates, None keeps the rate of the file.
+        block_frames (int): The number of frames of every decoded block.
+
+    Output: rates, blocks
+        rates (list): The sample rate of the output for every target sample rate.
+        blocks (generator): The list of output blocks for every decoded block, one block per
+                            target sample rate.
+    '''
+    blocks = read_blocks(file, block_frames)
+    first, sample_rate = next(blocks)
+    rates = [rate or sample_rate for rate in sample_rates]
+    resamplers = [BlockResampler(sample_rate, rate) for rate in rates]
+
+    def resampled():
+        for block in chain([first], (block for block, _ in blocks)):
+            yield [resampler.push(block) for resampler in resamplers]
+        # flush the frames held back for the filter context
+        yield [resampler.push(first[..., :0], final=True) for resampler in resamplers]
+    return rates, resampled()
+
+
+def decode_files(files, sample_rates, num_workers=None, max_pending=None):
+    '''Method for decoding sound files in a pool of processes. The decoded clips are yielded in
+    the order of files with at most max_pending files decoded ahead, see ordered_map.
+
+    Args: files, sample_rates, num_workers, max_pending
+        files (list): The locations of the sound files.
+        sample_rates (list): The target sample rates, None keeps the rate of the file.
+        num_workers (int): The number of decoding processes, 0 decodes in this process.
+                           Default is the number of cores.
+        max_pending (int): The number of files decoded ahead. Default is twice num_workers.
+
+    Output: decoded (generator)
+        decoded (tuple): The file_name and clips of every file, see decode_file.
+    '''
+    return ordered_map(partial(decode_file, sample_rates=sample_rates), files, num_workers,
+                       max_pending)
+
+
+def storage_report(file_path):
+    '''Method for measuring how well the audio file at file_path is compressed and how fast it is
+    decoded. Every clip is read back once, so the throughput is that of a warm page cache.
+
+    Args: file_path
+        file_path (string): The location of the audio file written by the audio_writer.
+
+    Output: report
+        report (dict): The stored and decoded bytes, the compression ratio, the decode time in
+                       seconds and the decode throughput in MB and in audio seconds per second.
+    '''
+    store = open_store(file_path)
+    # a sharded output is stored in its shards
+    stored_bytes = sum(os.path.getsize(path) for path in getattr(store, 'files', [file_path]))
+    decoded_bytes = int(np.sum(store.lengths)) * store.channels * store.dtype.itemsize
+    start = time.perf_counter()
+    for row in range(len(store.names)):
+        # copied so that the pages of memory mapped clips are actually read
+        np.array(store.read(row), copy=True)
+    seconds = max(time.perf_counter() - start, 1e-9)
+    store.close()
+    return {'stored_bytes': stored_bytes,
+            'decoded_bytes': decoded_bytes,
+            'ratio': decoded_bytes / max(stored_bytes, 1),
+            'decode_seconds': seconds,
+            'decode_mb_per_second': decoded_bytes / seconds / 1e6,
+            'audio_seconds_per_second': np.sum(store.lengths) / store.sample_rate / seconds}
+
+
+def print_report(file_path, report):
+    '''Method for printing a storage_report
+
+    Args: file_path, report
+        file_path (string): The location of the audio file.
+        report (dict): The report of the audio file.
+    '''
+    print('{}: {:.1f} MB stored, {:.1f} MB decoded, compression ratio {:.2f}, decoded at '
+          '{:.1f} MB/s ({:.0f}x real time)'.format(
+              file_path, report['stored_bytes'] / 1e6, report['decoded_bytes'] / 1e6,
+              report['ratio'], report['decode_mb_per_second'],
+              report['audio_seconds_per_second']))
+
+
+def audio_writer(in_path, out_path='.', out_file='out.h5', layout='packed', sample_rates=None,
+                 dtype='float32', chunk_frames=None, compression=None, compression_level=None,
+                 shuffle=False, report=False, num_workers=None, max_pending=None, mode='w',
+                 hash_sources=False, flush_every=1000, extensions=AUDIO_EXTENSIONS, patterns=None,
+                 num_walkers=0, listing_cache=False, block_frames=None, max_shard_bytes=None,
+                 max_shard_clips=None):
     '''Method for storing sound file information into a .h5 file. This method will traverse through
-    every file in the in_path directory and will store the information in the out_file at the
+    every sound file in the in_path directory and will store the information in the out_file at the
     out_path location. This method assumes that the data stored in the audio files is stored
     channel_first and is stored in .wav format. The audio files will be normalized between 0 and 1
     and will be saved according to their names in the in_path directory without their extensions.
+    When sample rates are given every clip is resampled to each of them at write time. The first
+    rate is written to out_file and every other rate to its own file next to it, named by
+    AudioStore.rate_path, for example 'out_16000.h5'. The files are decoded and resampled by a
+    pool of processes while this process alone writes the output. The files are decoded as soon as
+    the CorpusWalker finds them, in sorted order unless the tree is walked by several threads.
+    In streaming mode every file is instead decoded, resampled and written block by block by this
+    process, which bounds the memory by the block size however long the recordings are. With a
+    shard limit the output is split into shards next to out_file, which then holds the JSON shard
+    manifest, see ShardedWriter.
+    Every output stores a manifest of the sources it was written from. In mode 'a' an existing
+    output is updated instead of rewritten: only new and changed sources are decoded and the clips
+    of deleted sources are removed. The index and the manifest are written every flush_every
+    files, so an interrupted run is resumed by running it again in mode 'a'.
 
     Args: path, out_file
       in_path (string): The location of the sound file directory.
       out_path (string): The location to store the output .h5 file.
                          Default is the current directory.
       out_file (string): The name of the output .h5 file to be saved. Default is 'out.h5'.
+      layout (string): 'packed' to concatenate every clip into one dataset with an offset index,
+                       'keyed' to store every clip in its own dataset or 'raw' to write an
+                       uncompressed file with a JSON index for memory mapping. Default is 'packed'.
+      sample_rates (list): The sample rates to store. Default is the sample rate of the sources.
+      dtype (string): The storage dtype of the audio, 'int16' stores 16 bit PCM at half the size
+                      of 'float32' and 'float16' halves it as well. Default is 'float32'.
+      chunk_frames (int): The number of frames of every chunk of the .h5 layouts. Default is one
+                          sound_duration window.
+      compression (string): The compression filter of the .h5 layouts, one of 'gzip', 'lzf',
+                            'blosc' and 'lz4'. Default is None.
+      compression_level (int): The gzip or blosc compression level. Default is the filter's.
+      shuffle (bool): Whether to byte shuffle the chunks before compressing them. Default is False.
+      report (bool): Whether to print the compression ratio and the decode throughput of every
+                     output file. Default is False.
+      num_workers (int): The number of decoding processes, 0 decodes in this process.
+                         Default is the number of cores.
+      max_pending (int): The number of files decoded ahead of the writer. Default is twice
+                         num_workers.
+      mode (string): 'w' to write the outputs from scratch or 'a' to update existing outputs.
+                     Default is 'w'.
+      hash_sources (bool): Whether to compare the sources by the sha1 of their content instead of
+                           their size and mtime. Default is False.
+      flush_every (int): The number of files written between two checkpoints. Default is 1000.
+      extensions (tuple): The extensions of the sound files. Default is AUDIO_EXTENSIONS.
+      patterns (list): Glob patterns of which the path of a sound file relative to in_path has to
+                       match one. Default is every path.
+      num_walkers (int): The number of threads walking in_path. Default is 0.
+      listing_cache (bool): Whether to cache the listing of in_path next to the output so that
+                            an unchanged tree is not walked again. Default is False.
+      block_frames (int): The number of frames of every block in streaming mode. Default is None
+                          to decode whole files in the pool of processes.
+      max_shard_bytes (int): The uncompressed audio bytes of every shard. Default is no limit.
+      max_shard_clips (int): The number of clips of every shard. Default is no limit.
     '''
-    import torchaudio
-    mp3_dirs = [in_path +  directory for directory in os.listdir(in_path)]
-    mp3_files = []
-    while mp3_dirs:
-        curr_path = mp3_dirs.pop()
-        if os.path.isdir(curr_path):
-            for directory in os.listdir(curr_path):
-                mp3_dirs.append(curr_path + '/' + directory)
-        else:
-            mp3_files.append(curr_path)
     if not os.path.isdir(out_path):
         os.makedirs(out_path)
-    audio_frame = h5py.File(out_path + out_file, 'w')
-    total_files = len(mp3_files)
-    for num_file, file in enumerate(mp3_files):
-        clip = torchaudio.load(filepath=file,
-                               out=None,
-                               normalization=True,
-                               channels_first=True,
-                               num_frames=0,
-                               offset=0,
-                               signalinfo=None,
-                               encodinginfo=None,
-                               filetype=None)[0]
-        file_name = file.split('/')[-1].split('.wav')[0]
-        audio_frame.create_dataset(file_name, data=clip.numpy())
-        print('file {} of {} written'.format(
-            num_file + 1, total_files), end='\r')
-    audio_frame.close()
+    sample_rates = list(sample_rates or [None])
+    options = {'mode': mode, 'dtype': dtype, 'chunk_frames': chunk_frames,
+               'compression': compression, 'compression_level': compression_level,
+               'shuffle': shuffle}
+    if max_shard_bytes or max_shard_clips:
+        make_writer = partial(ShardedWriter, layout=layout, max_bytes=max_shard_bytes,
+                              max_clips=max_shard_clips, **options)
+    else:
+        make_writer = partial(WRITERS[layout], **options)
+    writers = [make_writer(out_path + out_file if num_rate == 0 else
+                           rate_path(out_path + out_file, rate))
+               for num_rate, rate in enumerate(sample_rates)]
+    files = walk_corpus(in_path, extensions, patterns, num_walkers,
+                        out_path + out_file + '.listing.json' if listing_cache else None)
+    # the sources are tracked relative to in_path so that the corpus can be moved
+    sources, stale, queued = {}, [set() for _ in writers], deque()
+
+    def stale_files():
+        for file in files:
+            path = os.path.relpath(file, in_path)
+            entry = source_entry(file, writers[0].manifest.get(path), hash_sources)
+            sources[path] = entry
+            for writer, writer_stale in zip(writers, stale):
+                if writer.stale({path: entry}):
+                    writer_stale.add(path)
+                else:
+                    # refresh the entry, for example a new mtime with the same hash
+                    writer.record(path, entry)
+            if any(path in writer_stale for writer_stale in stale):
+                queued.append(path)
+                yield file
+
+    if block_frames:
+        decoded = ((clip_name(file), stream_file(file, sample_rates, block_frames))
+                   for file in stale_files())
+    else:
+        decoded = decode_files(stale_files(), sample_rates, num_workers, max_pending)
+    num_file = -1
+    for num_file, (file_name, clips) in enumerate(decoded):
+        # the files are decoded in the order they were queued
+        path = queued.popleft()
+        # the writers that already hold the current clip of the file are skipped
+        active = [num_rate for num_rate, writer_stale in enumerate(stale) if path in writer_stale]
+        if block_frames:
+            rates, blocks = clips
+            for num_rate in active:
+                writers[num_rate].start_clip(file_name, rates[num_rate])
+            for rate_blocks in blocks:
+                for num_rate in active:
+                    writers[num_rate].write_block(rate_blocks[num_rate])
+            for num_rate in active:
+                writers[num_rate].end_clip()
+        else:
+            for num_rate in active:
+                clip, rate = clips[num_rate]
+                writers[num_rate].append(file_name, clip, rate)
+        for num_rate in active:
+            writers[num_rate].record(path, sources[path])
+        if (num_file + 1) % flush_every == 0:
+            for writer in writers:
+                writer.checkpoint()
+        print('file {} written'.format(num_file + 1), end='\r')
+    # the sources left out of the walk were deleted
+    for writer in writers:
+        for path in [path for path in writer.manifest if path not in sources]:
+            writer.remove(path)
+    print('{} files written, {} of {} files were up to date'.format(
+        num_file + 1, len(sources) - num_file - 1, len(sources)))
+    for writer in writers:
+        writer.close()
+    if report:
+        for writer in writers:
+            print_report(writer.file_path, storage_report(writer.file_path))
 
 def main():
     '''Main method for data writing'''
@@ -63,9 +1262,71 @@ def main():
                         help='output path for the data writer')
     parser.add_argument('out_file', metavar='DIR',
                         help='output fle for the data writer')
+    parser.add_argument('--layout', choices=sorted(WRITERS), default='packed',
+                        help='layout of the output file')
+    parser.add_argument('--sample_rates', type=int, nargs='+', default=None,
+                        help='sample rates to resample to, the first is written to out_file')
+    parser.add_argument('--dtype', choices=sorted(STORAGE_SCALES), default='float32',
+                        help='storage dtype of the audio')
+    parser.add_argument('--chunk_frames', type=int, default=None,
+                        help='frames of every chunk, default is one sound_duration window')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default=None,
+                        help='compression filter, blosc and lz4 need the hdf5plugin package')
+    parser.add_argument('--compression_level', type=int, default=None,
+                        help='gzip or blosc compression level')
+    parser.add_argument('--shuffle', action='store_true',
+                        help='byte shuffle the chunks before compressing them')
+    parser.add_argument('--report', action='store_true',
+                        help='print the compression ratio and decode throughput of the output')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of decoding processes, 0 decodes in the writing process')
+    parser.add_argument('--max_pending', type=int, default=None,
+                        help='number of files decoded ahead of the writer')
+    parser.add_argument('--append', action='store_true',
+                        help='update an existing output with the new, changed and deleted files')
+    parser.add_argument('--hash', action='store_true',
+                        help='compare the files by the hash of their content')
+    parser.add_argument('--flush_every', type=int, default=1000,
+                        help='number of files written between two checkpoints')
+    parser.add_argument('--extensions', nargs='+', default=list(AUDIO_EXTENSIONS),
+                        help='extensions of the sound files')
+    parser.add_argument('--patterns', nargs='+', default=None,
+                        help='glob patterns of the sound file paths relative to the dataset')
+    parser.add_argument('--walkers', type=int, default=0,
+                        help='number of threads walking the dataset, 0 walks in sorted order')
+    parser.add_argument('--listing_cache', action='store_true',
+                        help='cache the listing of the dataset next to the output')
+    parser.add_argument('--block_frames', type=int, default=None,
+                        help='decode and write the files in blocks of this many frames')
+    parser.add_argument('--max_shard_bytes', type=int, default=None,
+                        help='split the output into shards of this many uncompressed audio bytes')
+    parser.add_argument('--max_shard_clips', type=int, default=None,
+                        help='split the output into shards of this many clips')
     args = parser.parse_args()
     audio_writer(in_path=args.in_path,
                  out_path=args.out_path,
-                 out_file=args.out_file)
+                 out_file=args.out_file,
+                 layout=args.layout,
+                 sample_rates=args.sample_rates,
+                 dtype=args.dtype,
+                 chunk_frames=args.chunk_frames,
+                 compression=args.compression,
+                 compression_level=args.compression_level,
+                 shuffle=args.shuffle,
+                 report=args.report,
+                 num_workers=args.workers,
+                 max_pending=args.max_pending,
+                 mode='a' if args.append else 'w',
+                 hash_sources=args.hash,
+                 flush_every=args.flush_every,
+                 extensions=args.extensions,
+                 patterns=args.patterns,
+                 num_walkers=args.walkers,
+                 listing_cache=args.listing_cache,
+                 block_frames=args.block_frames,
+                 max_shard_bytes=args.max_shard_bytes,
+                 max_shard_clips=args.max_shard_clips)
 
-main()
+# guarded so that the decoding processes can import this module
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+'''
+This module is responsible for precomputing the spectral features of every clip written by the
+audio_writer of the DataWriter, so that a stable feature configuration does not have to be
+recomputed every epoch. The features are stored packed, chunked and compressed next to the audio
+file and tagged with the hash of the feature configuration, which the loaders check before they
+use them.
+'''
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import h5py
+import torch
+from WorkerPool import ordered_map
+
+# the loader modules are shared with the data loaders
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loader'))
+from AudioStore import open_store
+from AudioStore import dequantize
+from Features import FeatureExtractor
+
+# the audio store and feature extractor of every worker process
+_WORKER = {}
+
+
+def init_worker(in_file, config, sample_rate):
+    '''Method for opening the audio store and building the feature extractor in a worker
+
+    Args: in_file, config, sample_rate
+        in_file (string): The location of the audio file.
+        config (dict): The feature configuration.
+        sample_rate (int): The sample rate of the audio.
+    '''
+    # the workers already run in parallel so torch should not spawn threads of its own
+    torch.set_num_threads(1)
+    _WORKER['store'] = open_store(in_file)
+    _WORKER['extractor'] = FeatureExtractor(config, sample_rate)
+
+
+def compute_features(row):
+    '''Method for computing the features of a single clip in a worker
+
+    Args: row
+        row (int): The row of the clip in the audio store.
+
+    Output: features
+        features (np.ndarray): The features of shape (frames, channels, bins).
+    '''
+    store = _WORKER['store']
+    clip = torch.from_numpy(np.ascontiguousarray(dequantize(store.read(row), store.scale)))
+    return np.moveaxis(_WORKER['extractor'](clip[None])[0].numpy(), -1, 0)
+
+
+def feature_writer(in_file, config, out_file=None, num_workers=None, max_pending=None,
+                   compression='gzip', chunk_frames=256):
+    '''Method for storing the features of every clip of an audio file into a .h5 file. The
+    features of every clip are appended to one 'features' dataset of shape (frames, channels, bins)
+    with the same 'index' and 'names' datasets as the packed audio layout. The features are
+    computed at the sample rate stored with the audio, the one the loaders match them with.
+
+    Args: in_file, config, out_file, num_workers, max_pending, compression, chunk_frames
+      in_file (string): The location of the audio file written by the audio_writer.
+      config (dict): The feature configuration, see Features.FEATURE_DEFAULTS.
+      out_file (string): The location of the output .h5 file. Default is in_file + '.features.h5',
+                         where the loaders look for it.
+      num_workers (int): The number of worker processes, 0 computes the features in this process.
+                         Default is the number of cores.
+      max_pending (int): The number of clips computed ahead of the writer. Default is twice
+                         num_workers.
+      compression (string): The h5py compression filter of the features. Default is 'gzip'.
+      chunk_frames (int): The number of feature frames in every chunk. Default is 256.
+    '''
+    store = open_store(in_file)
+    names = list(store.names)
+    sample_rate = store.sample_rate
+    store.close()
+    extractor = FeatureExtractor(config, sample_rate)
+    out_file = out_file or in_file + '.features.h5'
+    feature_frame = h5py.File(out_file, 'w')
+    feature_frame.attrs['layout'] = 'packed'
+    feature_frame.attrs['config'] = json.dumps(extractor.config)
+    feature_frame.attrs['config_hash'] = extractor.hash
+    feature_frame.attrs['sample_rate'] = sample_rate
+    features, offsets, lengths = None, [], []
+    clips = ordered_map(compute_features, range(len(names)), num_workers, max_pending,
+                        initializer=init_worker, initargs=(in_file, config, sample_rate))
+    for row, clip in enumerate(clips):
+        if features is None:
+            features = feature_frame.create_dataset(
+                'features', shape=(0,) + clip.shape[1:], maxshape=(None,) + clip.shape[1:],
+                dtype=np.float32, chunks=(chunk_frames,) + clip.shape[1:],
+                compression=compression, shuffle=True)
+        offset = features.shape[0]
+        features.resize(offset + clip.shape[0], axis=0)
+        features[offset:] = clip
+        offsets.append(offset)
+        lengths.append(clip.shape[0])
+        print('clip {} of {} written'.format(row + 1, len(names)), end='\r')
+    if features is None:
+        feature_frame.create_dataset('features', shape=(0, 1, 1), maxshape=(None, 1, 1),
+                                     dtype=np.float32, chunks=True)
+    feature_frame.create_dataset(
+        'index', data=np.array([offsets, lengths], dtype=np.int64).T.reshape(-1, 2))
+    feature_frame.create_dataset(
+        'names', data=np.array(names, dtype=object), dtype=h5py.special_dtype(vlen=str))
+    feature_frame.close()
+
+
+def main():
+    '''Main method for feature writing'''
+    parser = argparse.ArgumentParser(
+        description='Spectral feature precomputation')
+    parser.add_argument('in_file', metavar='FILE',
+                        help='audio file written by the data writer')
+    parser.add_argument('config', metavar='JSON',
+                        help='feature configuration, for example \'{"type": "mel"}\'')
+    parser.add_argument('--out_file', metavar='FILE', default=None,
+                        help='output file, default is the audio file + .features.h5')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes, 0 computes in this process')
+    args = parser.parse_args()
+    feature_writer(in_file=args.in_file,
+                   config=json.loads(args.config),
+                   out_file=args.out_file,
+                   num_workers=args.workers)
+
+# guarded so that the worker processes can import this module
+if __name__ == '__main__':
+    main()
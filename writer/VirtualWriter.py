@@ -0,0 +1,117 @@
+'''
+This module is responsible for joining the packed shards written by the audio_writer of the
+DataWriter into one logical output. The master file holds an HDF5 virtual 'audio' dataset that maps
+the 'audio' dataset of every shard end to end, together with one merged 'index' and 'names', so the
+loaders open it as a single packed file through a single handle while the audio stays in the
+shards.
+'''
+
+import argparse
+import json
+import os
+import numpy as np
+import h5py
+
+
+def shard_files(in_files):
+    '''Method for expanding the shard manifests among the input files into their shards
+
+    Args: in_files
+        in_files (list): The locations of packed .h5 files or of JSON shard manifests.
+
+    Output: files
+        files (list): The locations of the packed .h5 files.
+    '''
+    files = []
+    for in_file in in_files:
+        if h5py.is_hdf5(in_file):
+            files.append(in_file)
+            continue
+        with open(in_file) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('shard_layout') != 'packed':
+            raise ValueError('{} holds {} shards, only packed shards can be joined'.format(
+                in_file, manifest.get('shard_layout')))
+        directory = os.path.dirname(in_file)
+        files.extend(os.path.join(directory, shard['file']) for shard in manifest['shards'])
+    return files
+
+
+def virtual_writer(in_files, out_file):
+    '''Method for building the master file of a set of packed shards. The virtual 'audio' dataset
+    refers to the shards by their path relative to the master file, so the master file has to
+    stay next to its shards when they are moved, and no audio is copied.
+
+    Args: in_files, out_file
+        in_files (list): The locations of the packed shards or of the JSON shard manifests
+                         written by the audio_writer.
+        out_file (string): The location of the master .h5 file.
+    '''
+    files = shard_files(in_files)
+    if not files:
+        raise ValueError('there are no shards to join')
+    out_directory = os.path.dirname(os.path.abspath(out_file))
+    shards, names, offsets, lengths = [], [], [], []
+    frames = 0
+    for file in files:
+        with h5py.File(file, 'r') as shard_frame:
+            layout = shard_frame.attrs.get('layout', 'keyed')
+            if isinstance(layout, bytes):
+                layout = layout.decode()
+            if layout != 'packed':
+                raise ValueError('{} is not a packed file'.format(file))
+            audio = shard_frame['audio']
+            shard = {'path': os.path.relpath(os.path.abspath(file), out_directory),
+                     'shape': audio.shape,
+                     'dtype': audio.dtype,
+                     'scale': float(audio.attrs.get('scale', 1.0)),
+                     'sample_rate': shard_frame.attrs.get('sample_rate')}
+            # the shards can only be joined when their frames are stored the same way
+            shard['format'] = (shard['shape'][1:], shard['dtype'], shard['scale'],
+                               shard['sample_rate'])
+            index = shard_frame['index'][:]
+            names.extend(name.decode() if isinstance(name, bytes) else str(name)
+                         for name in shard_frame['names'][:])
+        if shards and shard['format'] != shards[0]['format']:
+            raise ValueError('{} does not have the channels, dtype and sample rate of {}'.format(
+                file, files[0]))
+        # the clips of every shard are moved behind the frames of the shards before it
+        offsets.append(index[:, 0] + frames)
+        lengths.append(index[:, 1])
+        frames += shard['shape'][0]
+        shards.append(shard)
+    if len(set(names)) != len(names):
+        raise ValueError('the shards hold clips with the same names')
+    virtual = h5py.VirtualLayout(shape=(frames,) + shards[0]['shape'][1:],
+                                 dtype=shards[0]['dtype'])
+    start = 0
+    for shard in shards:
+        virtual[start:start + shard['shape'][0]] = h5py.VirtualSource(shard['path'], 'audio',
+                                                                      shape=shard['shape'])
+        start += shard['shape'][0]
+    with h5py.File(out_file, 'w') as master_frame:
+        master_frame.attrs['layout'] = 'packed'
+        if shards[0]['sample_rate'] is not None:
+            master_frame.attrs['sample_rate'] = shards[0]['sample_rate']
+        audio = master_frame.create_virtual_dataset('audio', virtual)
+        audio.attrs['scale'] = shards[0]['scale']
+        master_frame.create_dataset(
+            'index', data=np.stack([np.concatenate(offsets), np.concatenate(lengths)], axis=1)
+            .astype(np.int64))
+        master_frame.create_dataset(
+            'names', data=np.array(names, dtype=object), dtype=h5py.special_dtype(vlen=str))
+
+
+def main():
+    '''Main method for virtual dataset writing'''
+    parser = argparse.ArgumentParser(
+        description='Virtual dataset builder over packed shards')
+    parser.add_argument('out_file', metavar='FILE',
+                        help='master file to write')
+    parser.add_argument('in_files', metavar='FILE', nargs='+',
+                        help='packed shards or shard manifests written by the data writer')
+    args = parser.parse_args()
+    virtual_writer(args.in_files, args.out_file)
+
+if __name__ == '__main__':
+    main()
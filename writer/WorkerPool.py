@@ -0,0 +1,46 @@
+'''
+This module is responsible for the process pools of the writers. The items are processed by a
+bounded pool of processes and their results are handed to the single process writing the output
+in the order of the items.
+'''
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def ordered_map(function, items, num_workers=None, max_pending=None, initializer=None,
+                initargs=()):
+    '''Method for applying function to every item in a pool of processes. The results are yielded
+    in the order of items, and at most max_pending items are processed ahead of the consumer so
+    that a slow writer bounds the memory held by finished results.
+
+    Args: function, items, num_workers, max_pending, initializer, initargs
+        function (callable): The picklable function applied to every item.
+        items (iterable): The items, consumed lazily.
+        num_workers (int): The number of processes, 0 applies function in this process. Default is
+                           the number of cores.
+        max_pending (int): The number of items processed ahead. Default is twice num_workers.
+        initializer (callable): The function run once by every process before its first item.
+                                Default is None.
+        initargs (tuple): The arguments of initializer. Default is ().
+
+    Output: results (generator)
+        results (object): The result of function for every item.
+    '''
+    if num_workers == 0:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield function(item)
+        return
+    num_workers = num_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * num_workers
+    with ProcessPoolExecutor(num_workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,5 +1,6 @@
-'''Module for storing all the audio data labels in one large .h5 file. The input directory
-must only contain MusicXML files to store the data.'''
+'''Module for storing all the audio data labels in one large .h5 file. The MusicXML files are
+found anywhere below the input directory and the number of other files that are skipped is
+printed.'''
 
 import argparse
 import os
@@ -7,108 +8,120 @@ from fractions import Fraction
 import numpy as np
 import h5py
 from music21 import *
+from CorpusWalker import walk_corpus
+from WorkerPool import ordered_map
 
+# the extensions of the plain and the compressed MusicXML files
+XML_EXTENSIONS = ('.xml', '.musicxml', '.mxl')
 
-def xml_writer(in_path, out_path='', out_file='out.h5'):
-    '''Data writer that converts XML file metadata to data labels
+
+def parse_file(file):
+    '''Method for converting the metadata of a single XML file to data labels
+
+    Args: file
+        file (string): The location of the XML file.
+
+    Output: file_name, data
+        file_name (string): The name of the file without its directory and extension.
+        data (np.ndarray): The labels of every note and rest of the file.
+    '''
+    # initialize some important values
+    measure = 0
+    time_num, time_denom = 0, 0
+    note, octave = '', 0
+    dynamic = 'none'
+    duration = [0]
+    still_rest = True
+    # append the start token and start time to the labels
+    data = [('start', 'rest', 0, 'none')]
+    # retrieve the metadata from the xml objects
+    song = converter.parse(file)
+    metadata = song.recurse()
+    for msg in metadata:
+        if msg.classes[0] == 'Note':
+            note = msg.name
+            octave = msg.octave
+            time = Fraction(metadata.currentHierarchyOffset())
+            # only store the first note from the tie if it is tied
+            if msg.tie:
+                if msg.tie.type == 'start':
+                    duration.append(time)
+                    data.append((str(measure), note, octave, dynamic))
+            # store the note if it is not tied
+            else:
+                duration.append(time)
+                data.append((str(measure), note, octave, dynamic))
+            # reset the rest flag in case another rest shows up
+            still_rest = False
+        # current rest
+        elif msg.classes[0] == 'Rest':
+            # only store the first rest if there are multiple rest chains
+            if not still_rest:
+                # if the next note is a rest then the next pass will skip the
+                # if statement
+                still_rest = True
+                note = msg.name
+                time = Fraction(metadata.currentHierarchyOffset())
+                duration.append(time)
+                data.append((str(measure), note, 0, 'none'))
+        # current measure
+        elif msg.classes[0] == 'Measure':
+            measure += 1
+        # num: beats in a measure / denom: what constitutes one beat
+        elif msg.classes[0] == 'TimeSignature':
+            time_num = msg.numerator
+            time_denom = msg.denominator
+        # current dynamic
+        elif msg.classes[0] == 'Dynamic':
+            dynamic = msg.value
+        # current played note
+    # append the end time of the last note
+    duration.append(time + time_num - time % time_num)
+    # if the last data value appended was a rest then remove it before adding
+    # the end token
+    if still_rest:
+        data.pop()
+    else:
+        duration.append(time + time_num + time_num - time % time_num)
+    # append end token and correct the durations
+    data.append(('end', 'rest', 0, 'none'))
+    duration = np.array(duration) * Fraction(time_denom / 4)
+    # cast to numpy array and concatenate labels with time
+    dtypes = np.dtype([('measure', '<S5'), ('note', '<S5'), ('octave', 'i8'), ('dynamic', '<S5')])
+    data = np.asarray(data, dtype=dtypes)
+    start_beat = (duration[0:-1] % time_num) + 1
+    start_beat = start_beat.astype([('start_beat', '<f8')])
+    duration = duration[1:] - duration[0:-1]
+    duration = duration.astype([('duration', '<f8')])
+    # gather data and save the data
+    data = np.hstack((data['measure'].reshape(-1, 1), start_beat['start_beat'].reshape(-1, 1),
+                      duration['duration'].reshape(-1, 1), data['note'].reshape(-1, 1),
+                      data['octave'].reshape(-1, 1), data['dynamic'].reshape(-1, 1)))
+    file_name = os.path.splitext(os.path.basename(file))[0]
+    return file_name, data
+
+
+def xml_writer(in_path, out_path='', out_file='out.h5', num_walkers=0, num_workers=None):
+    '''Data writer that converts XML file metadata to data labels. The files are parsed in a
+    pool of processes and their labels are written by this process.
 
     Args: in_path
             in_path (string): location of the directory filled with XML files.
             out_path (string): location of the output file's directory.
             out_file (string): the output file's name
+            num_walkers (int): the number of threads walking in_path, 0 walks in sorted order.
+            num_workers (int): the number of parsing processes, 0 parses in this process. Default
+                               is the number of cores.
     '''
-    # collect the files in the input directory
-    xml_dirs = [in_path + directory for directory in os.listdir(in_path)]
-    xml_files = []
-    while xml_dirs:
-        curr_path = xml_dirs.pop()
-        if os.path.isdir(curr_path):
-            for directory in os.listdir(curr_path):
-                xml_dirs.append(curr_path + '/' + directory)
-        else:
-            xml_files.append(curr_path)
+    # collect the files in the input directory as they are found
+    xml_files = walk_corpus(in_path, XML_EXTENSIONS, num_workers=num_walkers)
     if not os.path.isdir(out_path):
         os.makedirs(out_path)
     label_frame = h5py.File(out_path + out_file, 'w')
-    total_files = len(xml_files)
-    # loop through all of the files and store the labels in a .h5 file.
-    for num_file, file in enumerate(xml_files):
-        # initialize some important values
-        measure = 0
-        time_num, time_denom = 0, 0
-        note, octave = '', 0
-        dynamic = 'none'
-        duration = [0]
-        still_rest = True
-        # append the start token and start time to the labels
-        data = [('start', 'rest', 0, 'none')]
-        # retrieve the metadata from the xml objects
-        song = converter.parse(file)
-        metadata = song.recurse()
-        for msg in metadata:
-            if msg.classes[0] == 'Note':
-                note = msg.name
-                octave = msg.octave
-                time = Fraction(metadata.currentHierarchyOffset())
-                # only store the first note from the tie if it is tied
-                if msg.tie:
-                    if msg.tie.type == 'start':
-                        duration.append(time)
-                        data.append((str(measure), note, octave, dynamic))
-                # store the note if it is not tied
-                else:
-                    duration.append(time)
-                    data.append((str(measure), note, octave, dynamic))
-                # reset the rest flag in case another rest shows up
-                still_rest = False
-            # current rest
-            elif msg.classes[0] == 'Rest':
-                # only store the first rest if there are multiple rest chains
-                if not still_rest:
-                    # if the next note is a rest then the next pass will skip the
-                    # if statement
-                    still_rest = True
-                    note = msg.name
-                    time = Fraction(metadata.currentHierarchyOffset())
-                    duration.append(time)
-                    data.append((str(measure), note, 0, 'none'))
-            # current measure
-            elif msg.classes[0] == 'Measure':
-                measure += 1
-            # num: beats in a measure / denom: what constitutes one beat
-            elif msg.classes[0] == 'TimeSignature':
-                time_num = msg.numerator
-                time_denom = msg.denominator
-            # current dynamic
-            elif msg.classes[0] == 'Dynamic':
-                dynamic = msg.value
-            # current played note
-        # append the end time of the last note
-        duration.append(time + time_num - time % time_num)
-        # if the last data value appended was a rest then remove it before adding
-        # the end token
-        if still_rest:
-            data.pop()
-        else:
-            duration.append(time + time_num + time_num - time % time_num)
-        # append end token and correct the durations
-        data.append(('end', 'rest', 0, 'none'))
-        duration = np.array(duration) * Fraction(time_denom / 4)
-        # cast to numpy array and concatenate labels with time
-        dtypes = np.dtype([('measure', '<S5'), ('note', '<S5'), ('octave', 'i8'), ('dynamic', '<S5')])
-        data = np.asarray(data, dtype=dtypes)
-        start_beat = (duration[0:-1] % time_num) + 1
-        start_beat = start_beat.astype([('start_beat', '<f8')])
-        duration = duration[1:] - duration[0:-1]
-        duration = duration.astype([('duration', '<f8')])
-        # gather data and save the data
-        data = np.hstack((data['measure'].reshape(-1, 1), start_beat['start_beat'].reshape(-1, 1),
-                          duration['duration'].reshape(-1, 1), data['note'].reshape(-1, 1),
-                          data['octave'].reshape(-1, 1), data['dynamic'].reshape(-1, 1)))
-        file_name = file.split('/')[-1].split('.xml')[0]
+    # store the labels of every file in a .h5 file as soon as it has been parsed
+    for num_file, (file_name, data) in enumerate(ordered_map(parse_file, xml_files, num_workers)):
         label_frame.create_dataset(file_name, data=data)
-        print('file {} of {} written'.format(
-            num_file + 1, total_files), end='\r')
+        print('file {} written'.format(num_file + 1), end='\r')
     label_frame.close()
 
 
@@ -122,7 +135,13 @@ def main():
                         help='path to output csv file')
     parser.add_argument('out_file', metavar='output file',
                         help='csv file name')
+    parser.add_argument('--walkers', type=int, default=0,
+                        help='number of threads walking the input directory')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of parsing processes, 0 parses in this process')
     args = parser.parse_args()
-    xml_writer(args.in_path, args.out_path, args.out_file)
+    xml_writer(args.in_path, args.out_path, args.out_file, args.walkers, args.workers)
 
-main()
+# guarded so that the worker processes can import this module
+if __name__ == '__main__':
+    main()